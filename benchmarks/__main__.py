@@ -0,0 +1,164 @@
+"""
+Copyright 2022 epiccakeking
+
+This file is part of epiccakeking_journal.
+
+epiccakeking_journal is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+epiccakeking_journal is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+epiccakeking_journal. If not, see <https://www.gnu.org/licenses/>.
+"""
+import argparse
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from collections import Counter
+from pathlib import Path
+
+from epiccakeking_journal.backend import count_stats, count_words, open_backend
+from benchmarks.generate import JournalGenerator
+
+
+def timed(function, repeat):
+    """Run function repeat times, returning timing info in seconds"""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        times.append(time.perf_counter() - start)
+    return dict(min=min(times), median=statistics.median(times), runs=repeat)
+
+
+def full_word_count(backend):
+    """What AltGui.update_cloud used to do"""
+    counts = Counter()
+    for day in backend.get_edited_days():
+        counts.update(count_words(backend.get_day(day)))
+    return counts
+
+
+def full_stats(backend):
+    """What StatsModal.update used to do"""
+    totals = [0, 0, 0]
+    for day in backend.get_edited_days():
+        for i, value in enumerate(count_stats(backend.get_day(day))):
+            totals[i] += value
+    return totals
+
+
+def format_benchmark(content, repeat):
+    """Time formatting a large buffer, needs Gtk but not a display"""
+    try:
+        import gi
+
+        gi.require_version("Gtk", "4.0")
+        from gi.repository import Gtk
+        from epiccakeking_journal.widgets import Formatter
+    except (ImportError, ValueError) as e:
+        return dict(skipped=str(e))
+    buffer = Gtk.TextBuffer()
+    formatter = Formatter(buffer)
+    buffer.set_text(content)
+    results = dict(full=timed(formatter.format, repeat))
+
+    def type_line():
+        buffer.insert(buffer.get_iter_at_line(buffer.get_line_count() // 2)[1], "x\n")
+
+    results["keystroke"] = timed(type_line, repeat)
+    return results
+
+
+def run(args):
+    generator = JournalGenerator(
+        years=args.years,
+        lines_per_day=args.lines_per_day,
+        words_per_line=args.words_per_line,
+        vocabulary=args.vocabulary,
+        code_chance=args.code_chance,
+        seed=args.seed,
+    )
+    terms = [generator.words[0], generator.words[len(generator.words) // 2], "zzzz"]
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = Path(temp_dir) / "journal"
+        start = time.perf_counter()
+        days = generator.write(path, args.storage)
+        results = dict(generate=dict(seconds=time.perf_counter() - start, days=days))
+
+        def fresh():
+            return open_backend(path, args.storage)
+
+        results["get_edited_days"] = timed(
+            lambda: list(fresh().get_edited_days()), args.repeat
+        )
+        # The first use of a fresh backend may build its indexes
+        results["search_cold"] = timed(lambda: list(fresh().search(terms[0])), 1)
+        backend = fresh()
+        for term in terms:
+            results[f"search_warm[{term}]"] = timed(
+                lambda: list(backend.search(term)), args.repeat
+            )
+        # Only the directory backend can search without its index
+        if hasattr(backend, "scan"):
+            results["search_full_scan"] = timed(
+                lambda: list(backend.scan(terms[0])), args.repeat
+            )
+        results["word_frequencies_cold"] = timed(lambda: fresh().word_frequencies(), 1)
+        results["word_frequencies_warm"] = timed(
+            lambda: backend.word_frequencies(), args.repeat
+        )
+        results["word_count_full_scan"] = timed(
+            lambda: full_word_count(backend), args.repeat
+        )
+        results["stats_cold"] = timed(lambda: fresh().stats(), 1)
+        results["stats_warm"] = timed(lambda: backend.stats(), args.repeat)
+        results["stats_full_scan"] = timed(lambda: full_stats(backend), args.repeat)
+        results["format"] = format_benchmark(
+            "\n".join(
+                generator.make_day() for _ in range(args.format_lines // 20 or 1)
+            ),
+            args.repeat,
+        )
+    return dict(
+        python=platform.python_version(),
+        platform=platform.platform(),
+        parameters=vars(args),
+        results=results,
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks", description="Benchmark the journal's hot paths"
+    )
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--lines-per-day", type=int, default=20)
+    parser.add_argument("--words-per-line", type=int, default=12)
+    parser.add_argument("--vocabulary", type=int, default=5000)
+    parser.add_argument("--code-chance", type=float, default=0.02)
+    parser.add_argument("--format-lines", type=int, default=10000)
+    parser.add_argument(
+        "--storage", choices=("directory", "sqlite"), default="directory"
+    )
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="Write JSON results here instead of stdout")
+    args = parser.parse_args()
+    results = json.dumps(run(args), indent=2)
+    if args.output:
+        Path(args.output).write_text(results)
+    else:
+        print(results)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,94 @@
+"""
+Copyright 2022 epiccakeking
+
+This file is part of epiccakeking_journal.
+
+epiccakeking_journal is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+epiccakeking_journal is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+epiccakeking_journal. If not, see <https://www.gnu.org/licenses/>.
+"""
+import datetime
+import random
+import string
+
+from epiccakeking_journal.backend import open_backend
+
+
+class JournalGenerator:
+    """Generates synthetic journal entries, the same ones for the same seed"""
+
+    def __init__(
+        self,
+        years=3,
+        edit_chance=0.8,
+        lines_per_day=20,
+        words_per_line=12,
+        vocabulary=5000,
+        code_chance=0.02,
+        seed=0,
+    ):
+        """
+        :param edit_chance: Chance of each day having an entry
+        :param vocabulary: Number of distinct words, used with a Zipf like distribution
+        :param code_chance: Chance of each line starting a code block
+        """
+        self.years = years
+        self.edit_chance = edit_chance
+        self.lines_per_day = lines_per_day
+        self.words_per_line = words_per_line
+        self.code_chance = code_chance
+        self.random = random.Random(seed)
+        self.words = [self.make_word() for _ in range(vocabulary)]
+        self.weights = [1 / (i + 1) for i in range(vocabulary)]
+
+    def make_word(self):
+        return "".join(
+            self.random.choices(string.ascii_lowercase, k=self.random.randint(2, 10))
+        )
+
+    def make_line(self):
+        words = self.random.choices(self.words, self.weights, k=self.words_per_line)
+        if self.random.random() < 0.1:
+            words[0] = words[0].capitalize()
+        return " ".join(words) + self.random.choice((".", ",", "!", ""))
+
+    def make_day(self):
+        lines = []
+        while len(lines) < self.lines_per_day:
+            roll = self.random.random()
+            if roll < self.code_chance:
+                lines += ["```", *(self.make_line() for _ in range(5)), "```"]
+            elif roll < 0.05:
+                lines.append("# " + self.make_line())
+            elif roll < 0.1:
+                lines.append("* " + self.make_line())
+            elif roll < 0.12:
+                lines.append("====================")
+            else:
+                lines.append(self.make_line())
+        return "\n".join(lines)
+
+    def days(self, end=datetime.date(2022, 1, 1)):
+        """Yield (date, content) for every edited day"""
+        day = end.replace(year=end.year - self.years)
+        while day < end:
+            if self.random.random() < self.edit_chance:
+                yield day, self.make_day()
+            day += datetime.timedelta(days=1)
+
+    def write(self, path, storage="directory"):
+        """Write a journal to path, returns the number of days written"""
+        backend = open_backend(path, storage)
+        count = 0
+        for day, content in self.days():
+            backend.save_day(day, content)
+            count += 1
+        return count
@@ -16,64 +16,1377 @@ You should have received a copy of the GNU General Public License along with
 epiccakeking_journal. If not, see <https://www.gnu.org/licenses/>.
 """
 import datetime
+import hashlib
+import heapq
+import io
 import json
+import math
+import mmap
+import os
+import re
+import string
+import struct
+import sys
+import threading
+import zlib
+from collections import Counter, OrderedDict
 from pathlib import Path
 
+from epiccakeking_journal.instrumentation import timed
+from epiccakeking_journal.query import Query
+from epiccakeking_journal.sketch import HeavyHitters
+
+letters = set(string.ascii_letters)
+
+
+def strip_non_letters(s):
+    for start, c in enumerate(s):
+        if c in letters:
+            break
+    for end in range(len(s) - 1, start - 1, -1):
+        if s[end] in letters:
+            end += 1
+            break
+    return s[start:end]
+
+
+def content_hash(data):
+    return hashlib.blake2b(data.encode(), digest_size=16).digest()
+
+
+def fsync_dir(path):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def count_words(data):
+    """Count the words of data as used by the word cloud"""
+    # Interned so the counts of every day share one copy of each word
+    words = (sys.intern(x) for x in map(strip_non_letters, data.split()) if x)
+    return Counter(words)
+
+
+def count_stats(data):
+    """Get the (characters, words, lines) of data"""
+    return [len(data), len(data.split()), data.count("\n") + 1]
+
+
+def index_lines(data):
+    """Get {word: [line_number, ...]} for the lowercase words of data"""
+    terms = {}
+    for i, line in enumerate(io.StringIO(data)):
+        for word in line.lower().split():
+            lines = terms.setdefault(word, [])
+            if not lines or lines[-1] != i:
+                lines.append(i)
+    return terms
+
+
+class LineMatcher:
+    """Scan mapper finding the lines containing a term, ignoring case"""
+
+    def __init__(self, term):
+        self.term = term.lower()
+
+    def __call__(self, data):
+        return [
+            (i, line)
+            for i, line in enumerate(io.StringIO(data))
+            if self.term in line.lower()
+        ]
+
+
+def can_match_bytes(term):
+    """Whether match_file gives the same results as LineMatcher for term"""
+    return bool(term) and term.isascii() and "\n" not in term and "\r" not in term
+
+
+def match_file(path, term):
+    """
+    Yield (line_number, line) for the lines of a file containing term, ignoring case.
+    The file is memory mapped and only lines with matches are decoded.
+    Only for terms where can_match_bytes is true.
+    """
+    pattern = re.compile(re.escape(term.encode()), re.IGNORECASE)
+    with open(path, "rb") as f:
+        try:
+            buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:  # Empty file
+            return
+    with buffer:
+        if re.search(rb"\r(?!\n)", buffer):
+            # Old Mac line endings are lines in text mode, read it like other days
+            data = buffer[:].decode().replace("\r\n", "\n").replace("\r", "\n")
+            yield from LineMatcher(term)(data)
+            return
+        line_number = 0
+        counted = 0  # Offset up to which newlines have been counted
+        while match := pattern.search(buffer, counted):
+            start = buffer.rfind(b"\n", counted, match.start()) + 1 or counted
+            while (newline := buffer.find(b"\n", counted, start)) != -1:
+                line_number += 1
+                counted = newline + 1
+            end = buffer.find(b"\n", match.end())
+            end = len(buffer) if end == -1 else end + 1
+            # Match text mode reads, which translate newlines
+            yield line_number, buffer[start:end].decode().replace("\r\n", "\n")
+            if end == len(buffer):
+                return
+            line_number += 1
+            counted = end
+
+
+class FileMatcher:
+    """Scan mapper like LineMatcher, but given the path of the day with match_file"""
+
+    def __init__(self, term):
+        self.term = term
+
+    def __call__(self, path):
+        return list(match_file(path, self.term))
+
+
+def rank_search(backend, term, k=50, recency=0.0):
+    """
+    Rank the results of backend.search(term) by the BM25 score of their day,
+    treating each day as a document, and more occurrences on the line to break ties.
+    recency boosts recent days, 1 doubles the score of a day written today,
+    fading over about a year.
+    Returns the top k as (date, line_number, line_content, score), best first.
+    """
+    k1, b = 1.2, 0.75
+    lower = term.lower()
+    days = {}
+    for day, i, line in backend.search(term):
+        days.setdefault(day, []).append((i, line, line.lower().count(lower) or 1))
+    if not days:
+        return []
+    day_count = sum(1 for _ in backend.get_edited_days())
+    average_length = backend.stats()[1] / day_count or 1
+    idf = math.log((day_count - len(days) + 0.5) / (len(days) + 0.5) + 1)
+    today = datetime.date.today()
+    scored = []
+    for day, hits in days.items():
+        frequency = sum(x[2] for x in hits)
+        length = backend.get_day_stats(day)[1]
+        score = (
+            idf
+            * frequency
+            * (k1 + 1)
+            / (frequency + k1 * (1 - b + b * length / average_length))
+        )
+        score *= 1 + recency * math.exp(-abs((today - day).days) / 365)
+        for i, line, count in hits:
+            scored.append((score, count, day, i, line))
+    return [
+        (day, i, line, score)
+        for score, _count, day, i, line in heapq.nlargest(
+            k, scored, key=lambda x: x[:2]
+        )
+    ]
+
+
+def scan_chunk(path, dates, mapper, read):
+    """Process a chunk of days in a scan worker"""
+    backend = Backend(path)
+    if not read:
+        return [mapper(backend.get_date_path(date)) for date in dates]
+    return [mapper(backend.get_day(date)) for date in dates]
+
+
+class DayCache:
+    """
+    Least recently used cache of day contents, limited by both the number of days
+    and their total length. Entries are only used while the file's version
+    (mtime and size) is unchanged, so edits made outside the app are noticed.
+    """
+
+    def __init__(self, max_days, max_size):
+        self.max_days = max_days
+        self.max_size = max_size
+        self.size = 0
+        # Maps dates to (version, data), least recently used first
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, date, version):
+        with self.lock:
+            entry = self.entries.get(date)
+            if entry is None or entry[0] != version:
+                return None
+            self.entries.move_to_end(date)
+            return entry[1]
+
+    def put(self, date, version, data):
+        with self.lock:
+            self.remove(date)
+            if len(data) > self.max_size:
+                return
+            self.entries[date] = version, data
+            self.size += len(data)
+            while len(self.entries) > self.max_days or self.size > self.max_size:
+                _date, (_version, old_data) = self.entries.popitem(last=False)
+                self.size -= len(old_data)
+
+    def discard(self, date):
+        with self.lock:
+            self.remove(date)
+
+    def peek(self, date):
+        """Get the cached contents of a day, whatever version of it they were"""
+        with self.lock:
+            entry = self.entries.get(date)
+            return entry and entry[1]
+
+    def remove(self, date):
+        entry = self.entries.pop(date, None)
+        if entry is not None:
+            self.size -= len(entry[1])
+
+
+class YearPack:
+    """
+    A year of days compressed into one file, for years which are rarely edited.
+    Each day is compressed separately and found through an index at the start,
+    so reading one day doesn't decompress the rest of the year.
+    The file is opened once, so it can be replaced while being read. It is closed
+    once nothing uses the pack, which may be a thread still reading a replaced one.
+    """
+
+    MAGIC = b"journal-pack-1\n"
+    HEADER = struct.Struct("<I")  # Length of the index
+    file = None
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, "rb")
+        stat = os.fstat(self.file.fileno())
+        self.file_version = stat.st_mtime_ns, stat.st_size
+        header = self.file.read(len(self.MAGIC) + self.HEADER.size)
+        if not header.startswith(self.MAGIC):
+            raise ValueError(f"{path} is not a journal pack")
+        (index_length,) = self.HEADER.unpack_from(header, len(self.MAGIC))
+        # Maps ISO dates to [offset, length, mtime, size], the offset is from the end
+        # of the index and mtime and size are of the day's file before it was packed
+        self.index = json.loads(self.file.read(index_length))
+        self.data_start = len(header) + index_length
+
+    def __contains__(self, date):
+        return date.isoformat() in self.index
+
+    def dates(self):
+        return [datetime.date.fromisoformat(key) for key in self.index]
+
+    def version(self, date):
+        """Version of the day's file when it was packed, like DayCache versions"""
+        entry = self.index.get(date.isoformat())
+        return entry and tuple(entry[2:])
+
+    def raw(self, key):
+        offset, length = self.index[key][:2]
+        return os.pread(self.file.fileno(), length, self.data_start + offset)
+
+    def read(self, date):
+        data = zlib.decompress(self.raw(date.isoformat()))
+        # Decode like the day's file would be read, newlines included
+        return io.TextIOWrapper(io.BytesIO(data)).read()
+
+    def __del__(self):
+        if self.file:
+            self.file.close()
+
+    @classmethod
+    def write(cls, path, days):
+        """Write a pack of days given as (key, version, compressed data) tuples"""
+        index = {}
+        blocks = []
+        offset = 0
+        for key, version, block in sorted(days):
+            index[key] = [offset, len(block), *version]
+            blocks.append(block)
+            offset += len(block)
+        index_data = json.dumps(index).encode()
+        temp_path = path.with_suffix(path.suffix + ".new")
+        with open(temp_path, "wb") as f:
+            f.write(cls.MAGIC + cls.HEADER.pack(len(index_data)) + index_data)
+            f.writelines(blocks)
+            f.flush()
+            os.fsync(f.fileno())
+        fsync_dir(path.parent)
+        temp_path.rename(path)
+        fsync_dir(path.parent)
+
+
+class DayStore:
+    """
+    Data derived from each day of a journal, saved in a file beside the journal.
+    Changed days are appended to a log, which is merged into the file once long.
+    Days whose files changed since they were recorded are reprocessed when loaded,
+    so a lost log entry only costs reprocessing that day.
+    """
+
+    NAME = None
+    VERSION = 1
+    # Log entries kept before the whole store is rewritten
+    LOG_MAX_ENTRIES = 1000
+    # Function getting the record to store for a day from its contents.
+    # It is run in scan worker processes, so it must be picklable.
+    analyze = None
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.path = backend.path.with_name(f"{backend.path.name}.{self.NAME}.json")
+        # JSON lines of [date, version, record], with a null version for removals
+        self.log_path = self.path.with_suffix(".log")
+        self.log_entries = 0
+        self.lock = threading.RLock()
+        # Maps ISO dates to the [mtime, size] of the file when it was processed
+        self.days = None
+
+    def load(self):
+        """Load the store if it isn't already, and bring it up to date"""
+        with self.lock:
+            if self.days is not None:
+                return
+            try:
+                data = json.loads(self.path.read_text())
+            except (OSError, ValueError):
+                data = {}
+            if data.get("version") != self.VERSION:
+                data = {}
+            self.days = data.get("days", {})
+            self.restore(data)
+            self.replay_log()
+            if self.sync() or self.log_entries > self.LOG_MAX_ENTRIES:
+                self.write()
+
+    def replay_log(self):
+        try:
+            with open(self.log_path) as f:
+                for line in f:
+                    try:
+                        key, version, record = json.loads(line)
+                    except ValueError:  # Cut short by a crash
+                        break
+                    self.log_entries += 1
+                    if key in self.days:
+                        self.remove_day(key)
+                        del self.days[key]
+                    if version is not None:
+                        self.days[key] = version
+                        self.add_day(key, record)
+        except FileNotFoundError:
+            pass
+
+    def sync(self):
+        """Reprocess days which changed on disk, returns whether anything changed"""
+        changed = []
+        seen = set()
+        for day in self.backend.get_edited_days():
+            key = day.isoformat()
+            seen.add(key)
+            if self.days.get(key) != self.file_version(day):
+                changed.append(day)
+        removed = set(self.days) - seen
+        for key in removed:
+            self.remove_day(key)
+            del self.days[key]
+        for day, record in self.backend.map_days(self.analyze, changed):
+            self.set_day(day, record)
+        return bool(changed or removed)
+
+    def file_version(self, date):
+        version = self.backend.day_version(date)
+        return version and list(version)
+
+    def set_day(self, date, record):
+        """Replace the record of a day, None removes it"""
+        key = date.isoformat()
+        if key in self.days:
+            self.remove_day(key)
+            del self.days[key]
+        if record is not None:
+            self.days[key] = self.file_version(date)
+            self.add_day(key, record)
+
+    def day_saved(self, date, data):
+        """Called by the backend after a day is written"""
+        self.days_saved([(date, data)])
+
+    def days_saved(self, days):
+        """Called by the backend after days are written, as (date, content) pairs"""
+        with self.lock:
+            # Unloaded stores catch up from file mtimes when they are loaded
+            if self.days is None or not days:
+                return
+            entries = []
+            for date, data in days:
+                record = self.analyze(data) if data else None
+                self.set_day(date, record)
+                key = date.isoformat()
+                entries.append(json.dumps([key, self.days.get(key), record]) + "\n")
+            self.log_entries += len(entries)
+            if self.log_entries > self.LOG_MAX_ENTRIES:
+                self.write()
+            else:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                with open(self.log_path, "a") as f:
+                    f.writelines(entries)
+
+    def write(self):
+        """Rewrite the whole store, emptying the log"""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        temp_file_path = self.path.with_suffix(self.path.suffix + ".new")
+        temp_file_path.write_text(
+            json.dumps(dict(self.dump(), version=self.VERSION, days=self.days))
+        )
+        temp_file_path.rename(self.path)
+        # Replaying entries already in the file would be harmless if this is lost
+        self.log_path.unlink(missing_ok=True)
+        self.log_entries = 0
+
+    def restore(self, data):
+        """Set up in memory state from saved data"""
+        raise NotImplementedError
+
+    def dump(self):
+        """Get the data to save, excluding the day list"""
+        raise NotImplementedError
+
+    def add_day(self, key, record):
+        raise NotImplementedError
+
+    def remove_day(self, key):
+        raise NotImplementedError
+
+
+class SearchIndex(DayStore):
+    """Inverted index mapping lowercase words to the lines containing them"""
+
+    NAME = "search_index"
+    analyze = staticmethod(index_lines)
+    # Above this share of the days a scan is faster than going through the index
+    MAX_CANDIDATE_SHARE = 0.5
+
+    def restore(self, data):
+        # {word: {date: [line_number, ...]}}
+        self.terms = data.get("terms", {})
+        # {trigram: {word, ...}} for substring lookups, built by the first search
+        self.trigrams = None
+        self.day_terms = {}
+        for term, postings in self.terms.items():
+            for key in postings:
+                self.day_terms.setdefault(key, []).append(term)
+
+    def dump(self):
+        return dict(terms=self.terms)
+
+    def add_day(self, key, day_terms):
+        for word, lines in day_terms.items():
+            if word not in self.terms and self.trigrams is not None:
+                for trigram in self.word_trigrams(word):
+                    self.trigrams.setdefault(trigram, set()).add(word)
+            self.terms.setdefault(word, {})[key] = lines
+        self.day_terms[key] = list(day_terms)
+
+    def remove_day(self, key):
+        for word in self.day_terms.pop(key, ()):
+            postings = self.terms[word]
+            del postings[key]
+            if not postings:
+                del self.terms[word]
+                if self.trigrams is not None:
+                    for trigram in self.word_trigrams(word):
+                        self.trigrams[trigram].discard(word)
+
+    @staticmethod
+    def word_trigrams(word):
+        return {word[i : i + 3] for i in range(len(word) - 2)}
+
+    def matching_words(self, part):
+        """Get the indexed words containing part, None if part is too short to look up"""
+        if len(part) < 3:
+            return None
+        if self.trigrams is None:
+            self.trigrams = {}
+            for word in self.terms:
+                for trigram in self.word_trigrams(word):
+                    self.trigrams.setdefault(trigram, set()).add(word)
+        words = min(
+            (self.trigrams.get(x, ()) for x in self.word_trigrams(part)), key=len
+        )
+        return [word for word in words if part in word]
+
+    def candidates(self, term):
+        """
+        Get the ISO dates of the days which may contain term.
+        Returns None if the index can't narrow the search down enough to be faster
+        than scanning, such as when term is only short words or very common.
+        """
+        self.load()
+        result = None
+        with self.lock:
+            # A match has to contain each whitespace separated part inside a word
+            for part in term.lower().split():
+                words = self.matching_words(part)
+                if words is None:
+                    continue
+                found = set()
+                for word in words:
+                    found.update(self.terms[word])
+                result = found if result is None else result & found
+            if result is not None and len(result) > self.MAX_CANDIDATE_SHARE * len(
+                self.days
+            ):
+                return None
+        return result
+
+
+class WordCounts(DayStore):
+    """Word counts for each day along with the total over all days"""
+
+    NAME = "word_counts"
+    analyze = staticmethod(count_words)
+
+    def restore(self, data):
+        # {date: {word: count}}, words are interned as the JSON has a copy per day
+        self.day_counts = {
+            key: {sys.intern(word): count for word, count in counts.items()}
+            for key, counts in data.get("day_counts", {}).items()
+        }
+        self.total = Counter(
+            {sys.intern(word): count for word, count in data.get("total", {}).items()}
+        )
+
+    def dump(self):
+        return dict(day_counts=self.day_counts, total=self.total)
+
+    def add_day(self, key, counts):
+        # Counts from worker processes or the log aren't interned yet
+        counts = {sys.intern(word): count for word, count in counts.items()}
+        self.day_counts[key] = counts
+        self.total.update(counts)
+
+    def remove_day(self, key):
+        counts = self.day_counts.pop(key, {})
+        self.total.subtract(counts)
+        for word in counts:
+            if self.total[word] <= 0:
+                del self.total[word]
+
+    def frequencies(self, exclude=()):
+        """Get (word, count) tuples over all days"""
+        self.load()
+        exclude = set(exclude)
+        with self.lock:
+            return [(w, c) for w, c in self.total.items() if w not in exclude]
+
+
+class DayStats(DayStore):
+    """Character, word and line counts for each day"""
+
+    NAME = "stats"
+    analyze = staticmethod(count_stats)
+
+    def restore(self, data):
+        # {date: [characters, words, lines]}
+        self.day_stats = data.get("day_stats", {})
+
+    def dump(self):
+        return dict(day_stats=self.day_stats)
+
+    def add_day(self, key, stats):
+        self.day_stats[key] = stats
+
+    def remove_day(self, key):
+        self.day_stats.pop(key, None)
+
+    def get(self, date):
+        self.load()
+        with self.lock:
+            return tuple(self.day_stats.get(date.isoformat(), (0, 0, 0)))
+
+    def totals(self, exclude=()):
+        self.load()
+        exclude = {day.isoformat() for day in exclude}
+        totals = [0, 0, 0]
+        with self.lock:
+            for key, stats in self.day_stats.items():
+                if key not in exclude:
+                    for i, value in enumerate(stats):
+                        totals[i] += value
+        return tuple(totals)
+
+
+class WordSketch:
+    """
+    Approximate word counts over all days in fixed memory, for the top words of
+    journals too large to count exactly. Kept up to date from the old and new
+    contents of changed days, and saved beside the journal along with the
+    versions of the days counted. Like a DayStore, changes are appended to a log
+    which is merged into the file once long.
+    """
+
+    MAGIC = b"journal-sketch-1\n"
+    HEADER = struct.Struct("<I")  # Length of the JSON part
+    # Log entries kept before the whole sketch is rewritten
+    LOG_MAX_ENTRIES = 1000
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.path = backend.path.with_name(f"{backend.path.name}.word_sketch")
+        # JSON lines of [date, old version, new version, {word: change in count}]
+        self.log_path = self.path.with_suffix(self.path.suffix + ".log")
+        self.log_entries = 0
+        self.lock = threading.RLock()
+        self.hitters = None
+        # Maps ISO dates to the [mtime, size] of the file when it was counted
+        self.days = None
+
+    def load(self):
+        """Load the sketch if it isn't already, and bring it up to date"""
+        with self.lock:
+            if self.hitters is not None:
+                return
+            try:
+                self.read()
+            except (OSError, ValueError):
+                self.hitters, self.days = HeavyHitters(), {}
+            self.replay_log()
+            current = {
+                day.isoformat(): list(self.backend.day_version(day))
+                for day in self.backend.get_edited_days()
+            }
+            stale = any(
+                current.get(key) != version for key, version in self.days.items()
+            )
+            if stale:
+                # The old contents of days changed since are gone, so their counts
+                # can't be taken out. Start over.
+                self.hitters, self.days = HeavyHitters(), {}
+            added = [
+                datetime.date.fromisoformat(key)
+                for key in current
+                if key not in self.days
+            ]
+            for day, counts in self.backend.map_days(count_words, added):
+                self.add(counts)
+                self.days[day.isoformat()] = current[day.isoformat()]
+            if stale or added or self.log_entries > self.LOG_MAX_ENTRIES:
+                self.write()
+
+    def read(self):
+        with open(self.path, "rb") as f:
+            header = f.read(len(self.MAGIC) + self.HEADER.size)
+            if not header.startswith(self.MAGIC):
+                raise ValueError(f"{self.path} is not a word sketch")
+            (length,) = self.HEADER.unpack_from(header, len(self.MAGIC))
+            info = json.loads(f.read(length))
+            hitters = HeavyHitters()
+            hitters.from_bytes(f.read())
+        hitters.candidates = info["candidates"]
+        self.hitters, self.days = hitters, info["days"]
+
+    def replay_log(self):
+        try:
+            with open(self.log_path) as f:
+                for line in f:
+                    try:
+                        key, old_version, version, changes = json.loads(line)
+                    except ValueError:  # Cut short by a crash
+                        break
+                    self.log_entries += 1
+                    # Entries already merged into the file are skipped, since the
+                    # counts aren't replaced like DayStore records but added to
+                    if self.days.get(key) == old_version:
+                        self.apply(key, version, changes)
+        except FileNotFoundError:
+            pass
+
+    def write(self):
+        """Rewrite the whole sketch, emptying the log"""
+        info = json.dumps(dict(candidates=self.hitters.candidates, days=self.days))
+        info = info.encode()
+        temp_path = self.path.with_suffix(self.path.suffix + ".new")
+        with open(temp_path, "wb") as f:
+            f.write(self.MAGIC + self.HEADER.pack(len(info)) + info)
+            f.write(self.hitters.to_bytes())
+            f.flush()
+            os.fsync(f.fileno())
+        temp_path.rename(self.path)
+        self.log_path.unlink(missing_ok=True)
+        self.log_entries = 0
+
+    def add(self, counts):
+        for word, count in counts.items():
+            self.hitters.add(word, count)
+
+    def apply(self, key, version, changes):
+        """Add the change in a day's counts, a None version means it was emptied"""
+        self.add(changes)
+        if version is None:
+            self.days.pop(key, None)
+        else:
+            self.days[key] = version
+
+    def days_saved(self, days):
+        """
+        Called by the backend after days are written, as (date, content, old content)
+        tuples. The old content is None when it isn't known.
+        """
+        with self.lock:
+            if self.hitters is None or not days:
+                return
+            entries = []
+            for date, data, old in days:
+                key = date.isoformat()
+                old_version = self.days.get(key)
+                changes = Counter()
+                if old_version is not None:
+                    if old is None:
+                        # Can't be corrected, so the next load starts over
+                        self.hitters = self.days = None
+                        self.path.unlink(missing_ok=True)
+                        self.log_path.unlink(missing_ok=True)
+                        self.log_entries = 0
+                        return
+                    changes.subtract(count_words(old))
+                version = None
+                if data:
+                    changes.update(count_words(data))
+                    version = list(self.backend.day_version(date))
+                changes = {word: count for word, count in changes.items() if count}
+                self.apply(key, version, changes)
+                entries.append(json.dumps([key, old_version, version, changes]) + "\n")
+            self.log_entries += len(entries)
+            if self.log_entries > self.LOG_MAX_ENTRIES:
+                self.write()
+            else:
+                with open(self.log_path, "a") as f:
+                    f.writelines(entries)
+
+    def top(self, k, exclude=()):
+        self.load()
+        with self.lock:
+            return self.hitters.top(k, exclude)
+
 
 class Backend:
+    # Days per task given to scan workers
+    SCAN_CHUNK_SIZE = 128
+    # Below this many days starting worker processes costs more than it saves
+    SCAN_PARALLEL_MIN_DAYS = 1000
+    # Worker processes for scans, shared by every backend and started when first used
+    scan_pool = None
+    scan_pool_broken = False
+    scan_pool_lock = threading.Lock()
+    # Limits of the day content cache, the size is in characters
+    CACHE_MAX_DAYS = 512
+    CACHE_MAX_SIZE = 32 * 2**20
+    # Days written by save_days between directory syncs and store updates
+    SAVE_BATCH_SIZE = 256
+
     def __init__(self, path):
         self.path = Path(path)
+        self.search_index = SearchIndex(self)
+        self.word_counts = WordCounts(self)
+        self.day_stats = DayStats(self)
+        self.stores = (self.search_index, self.word_counts, self.day_stats)
+        self.word_sketch = WordSketch(self)
+        # Maps (year, month) to the set of edited days in that month
+        self.month_cache = {}
+        # Hashes of day contents as last read or written, to skip unchanged saves
+        self.saved_hashes = {}
+        self.write_lock = threading.Lock()
+        self.cache = DayCache(self.CACHE_MAX_DAYS, self.CACHE_MAX_SIZE)
+        # Functions called with the date of each day changed outside the backend
+        self.listeners = []
+        # Maps years to their open YearPack
+        self.packs = {}
+        # Results of top_words, cleared when days change
+        self.top_words_cache = {}
 
     def get_date_path(self, date):
         return self.path / date.isoformat().replace("-", "/")
 
+    def get_pack_path(self, year):
+        return self.path / f"{year}.pack"
+
+    def get_pack(self, year):
+        """Get the YearPack of a year, None if the year isn't packed"""
+        path = self.get_pack_path(year)
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            self.packs.pop(year, None)
+            return None
+        pack = self.packs.get(year)
+        if pack is None or pack.file_version != (stat.st_mtime_ns, stat.st_size):
+            pack = self.packs[year] = YearPack(path)
+        return pack
+
+    def packed_years(self):
+        try:
+            with os.scandir(self.path) as entries:
+                return {
+                    int(x.name[:-5])
+                    for x in entries
+                    if x.name.endswith(".pack") and x.name[:-5].isdigit()
+                }
+        except FileNotFoundError:
+            return set()
+
+    def day_version(self, date):
+        """
+        Get the (mtime, size) of a day's file, None if it wasn't edited.
+        Packed days keep the version their file had when packed.
+        """
+        try:
+            stat = self.get_date_path(date).stat()
+        except FileNotFoundError:
+            pack = self.get_pack(date.year)
+            return pack and pack.version(date)
+        return stat.st_mtime_ns, stat.st_size
+
+    @timed("Backend.get_day")
     def get_day(self, date):
-        file_path = self.get_date_path(date)
-        if file_path.exists():
-            return file_path.read_text()
-        return ""
+        version = self.day_version(date)
+        if version is None:
+            self.cache.discard(date)
+            self.saved_hashes[date] = content_hash("")
+            return ""
+        data = self.cache.get(date, version)
+        if data is None:
+            try:
+                data = self.get_date_path(date).read_text()
+            except FileNotFoundError:
+                data = self.get_pack(date.year).read(date)
+            self.cache.put(date, version, data)
+            self.saved_hashes[date] = content_hash(data)
+        return data
 
     def month_edited_days(self, date):
-        path = self.get_date_path(date).parent
-        if not path.exists():
-            return []
-        return sorted(int(x.name) for x in path.iterdir())
+        return sorted(self.edited_days_by_month(date, date)[date.year, date.month])
 
+    def edited_days_by_month(self, start, end):
+        """
+        Get the edited days of every month from start to end (inclusive)
+        as {(year, month): {day, ...}}. The day of start and end is ignored.
+        """
+        months = []
+        year, month = start.year, start.month
+        while (year, month) <= (end.year, end.month):
+            months.append((year, month))
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        for year, month in months:
+            if (year, month) not in self.month_cache:
+                path = self.get_date_path(datetime.date(year, month, 1)).parent
+                days = {x[0] for x in self.list_numbered(path, None, None, False)}
+                pack = self.get_pack(year)
+                if pack:
+                    days.update(x.day for x in pack.dates() if x.month == month)
+                self.month_cache[year, month] = days
+        return {x: self.month_cache[x] for x in months}
+
+    @timed("Backend.save_day")
     def save_day(self, date, data):
-        file_path = self.get_date_path(date)
-        # For consistency ensure empty days don't have a file.
-        if data == "" and file_path.exists():
-            file_path.unlink()
-            return True
-        if data == self.get_day(date):
+        """Write a day to disk, safe to call from any thread"""
+        with self.write_lock:
+            data_hash = content_hash(data)
+            old = self.get_old_day(date)
+            if data_hash == self.saved_hashes[date]:
+                return True
+            file_path = self.get_date_path(date)
+            # For consistency ensure empty days don't have a file.
+            if data == "":
+                if file_path.exists():
+                    file_path.unlink()
+                    fsync_dir(file_path.parent)
+            else:
+                file_path.parent.mkdir(parents=True, exist_ok=True)
+                tmp_file_path = file_path.with_suffix(file_path.suffix + ".new")
+                with open(tmp_file_path, "w") as f:
+                    f.write(data)
+                    f.flush()
+                    os.fsync(f.fileno())
+                # Make sure the temp file's entry is on disk before swapping it in
+                fsync_dir(file_path.parent)
+                tmp_file_path.rename(file_path)
+                fsync_dir(file_path.parent)
+            # The day is now in the hot tree (or nowhere), so it leaves its pack
+            self.remove_packed_days(date.year, {date})
+            self.cache.discard(date)
+            # Reading translates newlines, so only cache what reads back the same
+            if data and "\r" not in data:
+                stat = file_path.stat()
+                self.cache.put(date, (stat.st_mtime_ns, stat.st_size), data)
+            self.saved_hashes[date] = data_hash
+            self.day_saved(date, data, old)
             return True
-        file_path.parent.mkdir(parents=True, exist_ok=True)
-        tmp_file_path = file_path.with_suffix(file_path.suffix + ".new")
-        tmp_file_path.write_text(data)
-        tmp_file_path.rename(file_path)
+
+    def save_days(self, days):
+        """
+        Write many (date, content) pairs, for bulk imports. Like save_day unchanged
+        days are skipped, but directories, packs and stores are updated once per
+        batch instead of once per day. Returns the number of days written.
+        """
+        written = 0
+        batch = []
+        for day in days:
+            batch.append(day)
+            if len(batch) == self.SAVE_BATCH_SIZE:
+                written += self.write_batch(batch)
+                batch = []
+        return written + self.write_batch(batch)
+
+    def write_batch(self, days):
+        with self.write_lock:
+            changed = []
+            # Directories to fsync, and those known to exist
+            directories = set()
+            created = set()
+            for date, data in days:
+                data_hash = content_hash(data)
+                old = self.get_old_day(date)
+                if data_hash == self.saved_hashes[date]:
+                    continue
+                file_path = self.get_date_path(date)
+                directories.add(file_path.parent)
+                if data and file_path.parent not in created:
+                    file_path.parent.mkdir(parents=True, exist_ok=True)
+                    created.add(file_path.parent)
+                if data == "":
+                    file_path.unlink(missing_ok=True)
+                else:
+                    tmp_file_path = file_path.with_suffix(file_path.suffix + ".new")
+                    with open(tmp_file_path, "w") as f:
+                        f.write(data)
+                        f.flush()
+                        os.fsync(f.fileno())
+                    tmp_file_path.rename(file_path)
+                self.cache.discard(date)
+                self.saved_hashes[date] = data_hash
+                changed.append((date, data, old))
+            # Months first so new directories are recorded in their parents
+            for directory in sorted(directories, reverse=True):
+                if directory.exists():
+                    fsync_dir(directory)
+            for directory in {x.parent for x in directories} | {self.path}:
+                if directory.exists():
+                    fsync_dir(directory)
+            for year in {x[0].year for x in changed}:
+                self.remove_packed_days(
+                    year, {x[0] for x in changed if x[0].year == year}
+                )
+            self.days_saved(changed)
+            return len(changed)
+
+    def pack_year(self, year):
+        """
+        Move the days of a past year into a compressed YearPack.
+        Saving a packed day moves it back to the year's directory.
+        """
+        if year >= datetime.date.today().year:
+            raise ValueError("Only past years can be packed")
+        with self.write_lock:
+            year_path = self.path / str(year)
+            old_pack = self.get_pack(year)
+            days = []
+            files = []
+            for month, month_path in self.list_numbered(year_path, None, None, False):
+                for day, day_path in self.list_numbered(month_path, None, None, False):
+                    try:
+                        key = datetime.date(year, month, day).isoformat()
+                    except ValueError:  # Not a real date, left where it is
+                        continue
+                    with open(day_path, "rb") as f:
+                        stat = os.fstat(f.fileno())
+                        data = f.read()
+                    days.append(
+                        (key, (stat.st_mtime_ns, stat.st_size), zlib.compress(data, 9))
+                    )
+                    files.append(Path(day_path))
+            if old_pack:
+                hot = {x[0] for x in days}
+                days.extend(
+                    (key, tuple(entry[2:]), old_pack.raw(key))
+                    for key, entry in old_pack.index.items()
+                    if key not in hot
+                )
+            if not days:
+                return
+            YearPack.write(self.get_pack_path(year), days)
+            # Packed days read the same, so their cached content stays valid
+            for file_path in files:
+                file_path.unlink()
+            for path in [*{x.parent for x in files}, year_path]:
+                try:
+                    path.rmdir()
+                except OSError:  # Not empty or already gone
+                    pass
+            fsync_dir(self.path)
+            for month in range(1, 13):
+                self.month_cache.pop((year, month), None)
+
+    def remove_packed_days(self, year, dates):
+        """Take days out of a year's pack, removing the pack if it becomes empty"""
+        pack = self.get_pack(year)
+        if not pack or not any(date in pack for date in dates):
+            return
+        keys = {date.isoformat() for date in dates}
+        days = [
+            (key, tuple(entry[2:]), pack.raw(key))
+            for key, entry in pack.index.items()
+            if key not in keys
+        ]
+        if days:
+            YearPack.write(pack.path, days)
+        else:
+            pack.path.unlink()
+            fsync_dir(pack.path.parent)
+
+    def add_listener(self, listener):
+        """Call listener(date) when a day is changed outside the app"""
+        self.listeners.append(listener)
+
+    def watch(self):
+        """
+        Start watching the journal for changes made outside the app, updating caches
+        and notifying listeners. Needs a running GLib main loop.
+        Returns the watcher, which can be stopped with its cancel method.
+        """
+        from epiccakeking_journal.watcher import JournalWatcher
+
+        return JournalWatcher(self.path, self.refresh_day)
+
+    def refresh_day(self, date):
+        """
+        Bring caches and stores up to date with a day's file after it may have
+        been changed outside the backend. Listeners are only told about real changes.
+        """
+        with self.write_lock:
+            old_hash = self.saved_hashes.get(date)
+            old = self.cache.peek(date)
+            data = self.get_day(date)
+            if self.saved_hashes[date] == old_hash:
+                return False
+            self.day_saved(date, data, old)
+        for listener in self.listeners:
+            listener(date)
         return True
 
-    def get_edited_days(self):
-        if not self.path.exists():
+    def get_old_day(self, date):
+        """
+        Get a day's contents before it is replaced, if the word sketch needs them.
+        Otherwise only make sure its hash is known.
+        """
+        if self.word_sketch.hitters is not None:
+            return self.get_day(date)
+        if date not in self.saved_hashes:
+            self.get_day(date)
+        return None
+
+    def day_saved(self, date, data, old=None):
+        self.days_saved([(date, data, old)])
+
+    def days_saved(self, days):
+        """Update caches and stores after days changed, as (date, content, old) tuples"""
+        if days:
+            self.top_words_cache.clear()
+        self.word_sketch.days_saved(days)
+        days = [(date, data) for date, data, _old in days]
+        for date, data in days:
+            month = self.month_cache.get((date.year, date.month))
+            if month is not None:
+                if data:
+                    month.add(date.day)
+                else:
+                    month.discard(date.day)
+        for store in self.stores:
+            store.days_saved(days)
+
+    @timed("Backend.get_edited_days")
+    def get_edited_days(self, start=None, end=None, reverse=False, limit=None):
+        """
+        Yield edited days in chronological order, or newest first if reverse.
+        Only days from start to end (inclusive) are given, up to limit days.
+        Years and months outside the range aren't listed.
+        """
+        if limit is not None and limit <= 0:
             return
-        for year_dir in self.path.iterdir():
-            year = int(year_dir.name)
-            for month_dir in year_dir.iterdir():
-                month = int(month_dir.name)
-                for day_file in month_dir.iterdir():
-                    yield datetime.date(year=year, month=month, day=int(day_file.name))
-
-    def search(self, term):
-        """Each result will be yielded as a tuple: (date, line_number, line_content)"""
-        for day in self.get_edited_days():
-            with open(self.get_date_path(day)) as f:
-                for i, line in enumerate(f):
-                    if term.lower() in line.lower():
-                        yield day, i, line
+        count = 0
+        years = dict(
+            self.list_numbered(self.path, start and start.year, end and end.year, False)
+        )
+        for year in self.packed_years():
+            if (not start or year >= start.year) and (not end or year <= end.year):
+                years.setdefault(year, None)
+        for year in sorted(years, reverse=reverse):
+            for day in self.year_edited_days(year, years[year], start, end, reverse):
+                yield day
+                count += 1
+                if count == limit:
+                    return
+
+    def year_edited_days(self, year, year_path, start, end, reverse):
+        """
+        Yield the edited days of a year from start to end in order, packed or not.
+        Month directories are only listed as the days are needed.
+        """
+        months = {}
+        if year_path:
+            months.update(
+                self.list_numbered(
+                    year_path,
+                    start.month if start and start.year == year else None,
+                    end.month if end and end.year == year else None,
+                    False,
+                )
+            )
+        # Maps months to their packed days, within the range
+        packed = {}
+        pack = self.get_pack(year)
+        if pack:
+            for day in pack.dates():
+                if (not start or day >= start) and (not end or day <= end):
+                    packed.setdefault(day.month, set()).add(day)
+                    months.setdefault(day.month, None)
+        for month in sorted(months, reverse=reverse):
+            # A day in both places is one which was edited after packing
+            days = packed.get(month, set())
+            if months[month]:
+                low = (
+                    start.day
+                    if start and (start.year, start.month) == (year, month)
+                    else None
+                )
+                high = (
+                    end.day if end and (end.year, end.month) == (year, month) else None
+                )
+                for day, _day_path in self.list_numbered(
+                    months[month], low, high, False
+                ):
+                    try:
+                        days.add(datetime.date(year, month, day))
+                    except ValueError:  # Not a real date
+                        continue
+            yield from sorted(days, reverse=reverse)
+
+    @staticmethod
+    def list_numbered(path, low, high, reverse):
+        """
+        Get sorted (number, path) tuples for the entries of path named as numbers
+        from low to high, either of which may be None for no limit.
+        Anything else, such as temp files, is skipped.
+        """
+        try:
+            with os.scandir(path) as entries:
+                found = [
+                    (int(x.name), x.path)
+                    for x in entries
+                    if x.name.isascii() and x.name.isdigit()
+                ]
+        except (FileNotFoundError, NotADirectoryError):
+            return []
+        return sorted(
+            (
+                x
+                for x in found
+                if (low is None or x[0] >= low) and (high is None or x[0] <= high)
+            ),
+            reverse=reverse,
+        )
+
+    def word_frequencies(self, exclude=()):
+        """Get (word, count) tuples for every word used, except those in exclude"""
+        return self.word_counts.frequencies(exclude)
+
+    def stats(self, exclude=()):
+        """Get the total (characters, words, lines) of all days not in exclude"""
+        return self.day_stats.totals(exclude)
+
+    def top_words(self, k, exclude=(), approximate=False):
+        """
+        Get the k most used words not in exclude as (word, count) tuples, most used
+        first. If approximate the counts come from the WordSketch, so memory doesn't
+        grow with the vocabulary but counts may be a little high.
+        """
+        exclude = frozenset(exclude)
+        key = k, exclude, approximate
+        if key not in self.top_words_cache:
+            if approximate:
+                words = self.word_sketch.top(k, exclude)
+            else:
+                words = heapq.nlargest(
+                    k, self.word_frequencies(exclude), key=lambda x: x[1]
+                )
+            self.top_words_cache[key] = words
+        return self.top_words_cache[key]
+
+    @timed("Backend.search")
+    def search(self, term, cancelled=None):
+        """
+        Each result will be yielded as a tuple: (date, line_number, line_content)
+        Stops early once the cancelled Event, if given, is set.
+        """
+        candidates = self.search_index.candidates(term)
+        if candidates is None:
+            yield from self.scan(term, cancelled)
+            return
+        for key in sorted(candidates):
+            if cancelled is not None and cancelled.is_set():
+                return
+            day = datetime.date.fromisoformat(key)
+            path = self.get_date_path(day)
+            # Packed days don't have a file to map
+            if can_match_bytes(term) and path.exists():
+                matches = match_file(path, term)
+            else:
+                matches = LineMatcher(term)(self.get_day(day))
+            for i, line in matches:
+                yield day, i, line
+
+    def get_day_stats(self, date):
+        """Get the (characters, words, lines) of a day"""
+        return self.day_stats.get(date)
+
+    def ranked_search(self, term, k=50, recency=0.0):
+        """Get the best k results of search(term) with scores, see rank_search"""
+        return rank_search(self, term, k, recency)
+
+    def query(self, text, cancelled=None):
+        """
+        Search with the query language described in epiccakeking_journal.query.
+        Results are the same tuples as search, raises QueryError for invalid queries.
+        """
+        return Query(text).search(self, cancelled)
+
+    def term_days(self, term):
+        """Get the ISO dates of days which may contain term, None if it could be any"""
+        return self.search_index.candidates(term)
+
+    def scan(self, term, cancelled=None):
+        """Search without the index, reading every day"""
+        if can_match_bytes(term) and not self.packed_years():
+            results = self.map_days(FileMatcher(term), read=False, cancelled=cancelled)
+        else:
+            results = self.map_days(LineMatcher(term), cancelled=cancelled)
+        for day, matches in results:
+            for i, line in matches:
+                yield day, i, line
+
+    @classmethod
+    def get_scan_pool(cls):
+        """The worker processes shared by every scan, None if they can't be used"""
+        with cls.scan_pool_lock:
+            if cls.scan_pool is None and not cls.scan_pool_broken:
+                # Only imported when needed, they are slow to import for the command line
+                import multiprocessing
+                from concurrent.futures import ProcessPoolExecutor
+
+                # Forking a process with Gtk threads running isn't safe, so use spawn
+                cls.scan_pool = ProcessPoolExecutor(
+                    os.cpu_count(), mp_context=multiprocessing.get_context("spawn")
+                )
+            return cls.scan_pool
+
+    @classmethod
+    def scan_pool_failed(cls):
+        """
+        Stop using worker processes. Usually they failed to start because the main
+        module starts scans when imported, which would happen again every time.
+        """
+        with cls.scan_pool_lock:
+            cls.scan_pool_broken = True
+            if cls.scan_pool is not None:
+                cls.scan_pool.shutdown(wait=False)
+                cls.scan_pool = None
+
+    def map_days(self, mapper, days=None, read=True, cancelled=None):
+        """
+        Yield (date, mapper(content)) for days (default every edited day) in date order.
+        If read is false mapper is given the path of the day instead of its content,
+        which packed days don't have.
+        Large sets of days are split into chunks processed by worker processes when
+        there is more than one CPU, so mapper must be picklable. The workers import
+        the main module, without an if __name__ == "__main__" guard they fail and
+        days are processed here instead.
+        Stops early once the cancelled Event, if given, is set.
+        """
+        days = sorted(self.get_edited_days() if days is None else days)
+        chunks = [
+            days[i : i + self.SCAN_CHUNK_SIZE]
+            for i in range(0, len(days), self.SCAN_CHUNK_SIZE)
+        ]
+        futures = []
+        if len(days) >= self.SCAN_PARALLEL_MIN_DAYS and (os.cpu_count() or 1) > 1:
+            pool = self.get_scan_pool()
+            if pool is not None:
+                from concurrent.futures.process import BrokenProcessPool
+
+                try:
+                    futures = [
+                        pool.submit(scan_chunk, self.path, chunk, mapper, read)
+                        for chunk in chunks
+                    ]
+                except BrokenProcessPool:
+                    self.scan_pool_failed()
+        for i, chunk in enumerate(chunks):
+            results = None
+            if futures:
+                try:
+                    results = futures[i].result()
+                except BrokenProcessPool:
+                    self.scan_pool_failed()
+                    futures = []
+            for j, day in enumerate(chunk):
+                if cancelled is not None and cancelled.is_set():
+                    # Chunks already running are left to finish
+                    for future in futures:
+                        future.cancel()
+                    return
+                if results is not None:
+                    yield day, results[j]
+                else:
+                    yield day, mapper(
+                        self.get_day(day) if read else self.get_date_path(day)
+                    )
+
+
+def open_backend(path, storage="directory"):
+    """
+    Open the journal at path with the storage engine named by the storage setting.
+    The SQLite database is kept beside the journal directory.
+    """
+    path = Path(path)
+    if storage == "sqlite":
+        from epiccakeking_journal.sqlite_backend import SqliteBackend
+
+        return SqliteBackend(path.with_name(path.name + ".sqlite3"))
+    return Backend(path)
+
+
+def migrate(source, destination):
+    """Make destination hold exactly the days of source"""
+    days = set(source.get_edited_days())
+    destination.save_days((day, source.get_day(day)) for day in sorted(days))
+    destination.save_days(
+        (day, "") for day in list(destination.get_edited_days()) if day not in days
+    )
 
 
 class Settings:
-    DEFAULTS = dict(date_format="", alt_gui=False, word_cloud_exclusions=[])
+    DEFAULTS = dict(
+        date_format="",
+        alt_gui=False,
+        word_cloud_exclusions=[],
+        storage="directory",
+        instrumentation=False,
+        approximate_word_cloud=False,
+    )
 
     def __init__(self, path):
         self.path = path
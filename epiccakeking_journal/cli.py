@@ -0,0 +1,361 @@
+"""
+Copyright 2022 epiccakeking
+
+This file is part of epiccakeking_journal.
+
+epiccakeking_journal is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+epiccakeking_journal is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+epiccakeking_journal. If not, see <https://www.gnu.org/licenses/>.
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import sys
+import time
+from pathlib import Path, PurePosixPath
+
+from epiccakeking_journal import instrumentation
+from epiccakeking_journal.backend import Settings, open_backend
+from epiccakeking_journal.query import QueryError
+
+APP_ID = "io.github.epiccakeking.Journal"
+# Subcommands handled here, anything else starts the app
+COMMANDS = ("export", "import", "search", "stats", "top-words", "calendar", "pack")
+FORMATS = ("jsonl", "markdown", "tar")
+
+
+def user_dir(variable, default):
+    """The app's directory under an XDG base directory, like GLib finds them"""
+    return Path(os.environ.get(variable) or Path.home() / default) / APP_ID
+
+
+def load_settings():
+    return Settings(user_dir("XDG_CONFIG_HOME", ".config") / "settings.json")
+
+
+def open_journal(args):
+    storage = args.storage or load_settings().get("storage")
+    path = args.journal or user_dir("XDG_DATA_HOME", ".local/share") / "journal"
+    return open_backend(path, storage)
+
+
+def parse_month(text):
+    try:
+        day = datetime.date.fromisoformat(f"{text}-01")
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a YYYY-MM month: {text}")
+    return day
+
+
+def parse_date(text):
+    try:
+        return datetime.date.fromisoformat(text)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"not a YYYY-MM-DD date: {text}")
+
+
+def date_from_name(name):
+    """Get the date of an exported day's file name, None for other files"""
+    try:
+        return datetime.date.fromisoformat(PurePosixPath(name).stem)
+    except ValueError:
+        print(f"Skipping {name}, not named as a date", file=sys.stderr)
+        return None
+
+
+def read_days(backend, start=None, end=None):
+    for day in backend.get_edited_days(start, end):
+        yield day, backend.get_day(day)
+
+
+def write_jsonl(days, output):
+    for day, content in days:
+        output.write(json.dumps(dict(date=day.isoformat(), content=content)) + "\n")
+
+
+def read_jsonl(source):
+    for line in source:
+        if line.strip():
+            entry = json.loads(line)
+            yield datetime.date.fromisoformat(entry["date"]), entry["content"]
+
+
+def write_markdown(days, directory):
+    directory.mkdir(parents=True, exist_ok=True)
+    for day, content in days:
+        with open(directory / f"{day.isoformat()}.md", "w", newline="") as f:
+            f.write(content)
+
+
+def read_markdown(directory):
+    for path in sorted(directory.glob("*.md")):
+        day = date_from_name(path.name)
+        if day:
+            with open(path, newline="") as f:
+                yield day, f.read()
+
+
+def write_tar(days, output):
+    import tarfile
+
+    mtime = time.time()
+    with tarfile.open(fileobj=output, mode="w|") as tar:
+        for day, content in days:
+            data = content.encode()
+            info = tarfile.TarInfo(f"{day.isoformat()}.md")
+            info.size = len(data)
+            info.mtime = mtime
+            tar.addfile(info, io.BytesIO(data))
+
+
+def read_tar(source):
+    import tarfile
+
+    try:
+        # Stream mode reads members in order without seeking
+        with tarfile.open(fileobj=source, mode="r|*") as tar:
+            for member in tar:
+                if member.isfile():
+                    day = date_from_name(member.name)
+                    if day:
+                        yield day, tar.extractfile(member).read().decode()
+    except tarfile.TarError as e:
+        raise ValueError(f"Invalid tar archive: {e}")
+
+
+def open_stream(path, mode):
+    """Open path, with - meaning stdin or stdout"""
+    if path != "-":
+        return open(path, mode)
+    stream = sys.stdin if "r" in mode else sys.stdout
+    # Closing the returned stream shouldn't close stdin or stdout
+    return open(stream.fileno(), mode, closefd=False)
+
+
+def export_command(args):
+    days = read_days(open_journal(args), args.start, args.end)
+    if args.format == "markdown":
+        if args.output == "-":
+            raise ValueError("markdown exports need a directory, given with --output")
+        write_markdown(days, Path(args.output))
+    elif args.format == "tar":
+        with open_stream(args.output, "wb") as output:
+            write_tar(days, output)
+    else:
+        with open_stream(args.output, "w") as output:
+            write_jsonl(days, output)
+    return 0
+
+
+def import_command(args):
+    backend = open_journal(args)
+    total = 0
+
+    def counted(days):
+        nonlocal total
+        for day in days:
+            total += 1
+            yield day
+
+    if args.format == "markdown":
+        if args.input == "-":
+            raise ValueError("markdown imports need a directory, given with --input")
+        written = backend.save_days(counted(read_markdown(Path(args.input))))
+    else:
+        binary = args.format == "tar"
+        with open_stream(args.input, "rb" if binary else "r") as source:
+            reader = read_tar if binary else read_jsonl
+            written = backend.save_days(counted(reader(source)))
+    print(f"Imported {total} days, {total - written} unchanged", file=sys.stderr)
+    return 0
+
+
+def search_command(args):
+    backend = open_journal(args)
+    text = " ".join(args.terms)
+    if args.ranked:
+        results = backend.ranked_search(text, args.limit or 50)
+    else:
+        try:
+            results = backend.query(text)
+        except QueryError:
+            # Like the app, text which isn't a valid query is searched for as is
+            results = backend.search(text)
+    for count, (day, i, line, *score) in enumerate(results, 1):
+        line = line.rstrip("\n")
+        if args.json:
+            result = dict(date=day.isoformat(), line=i + 1, content=line)
+            if score:
+                result["score"] = score[0]
+            print(json.dumps(result))
+        else:
+            print(f"{day.isoformat()}:{i + 1}: {line}")
+        if count == args.limit:
+            break
+    return 0
+
+
+def stats_command(args):
+    backend = open_journal(args)
+    days = sum(1 for _ in backend.get_edited_days())
+    characters, words, lines = backend.stats()
+    stats = dict(days=days, characters=characters, words=words, lines=lines)
+    if args.json:
+        print(json.dumps(stats))
+    else:
+        for name, value in stats.items():
+            print(f"{name}: {value}")
+    return 0
+
+
+def top_words_command(args):
+    backend = open_journal(args)
+    exclude = () if args.all else load_settings().get("word_cloud_exclusions")
+    for word, count in backend.top_words(args.count, exclude, args.approximate):
+        if args.json:
+            print(json.dumps(dict(word=word, count=count)))
+        else:
+            print(f"{count:>8} {word}")
+    return 0
+
+
+def calendar_command(args):
+    import calendar
+
+    backend = open_journal(args)
+    month = args.month
+    edited = backend.month_edited_days(month)
+    if args.json:
+        print(json.dumps(dict(month=month.strftime("%Y-%m"), edited_days=edited)))
+        return 0
+    # Like cal, with edited days marked by a *
+    print(calendar.month_name[month.month], month.year)
+    print(" ".join(f"{x[:2]:>3}" for x in calendar.day_abbr))
+    for week in calendar.monthcalendar(month.year, month.month):
+        print(
+            " ".join(
+                f"{day or '':>2}{'*' if day in edited else ' '}" for day in week
+            ).rstrip()
+        )
+    return 0
+
+
+def pack_command(args):
+    backend = open_journal(args)
+    if not hasattr(backend, "pack_year"):
+        raise ValueError("only the directory storage can pack years")
+    backend.pack_year(args.year)
+    return 0
+
+
+def make_parser():
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument(
+        "--journal", type=Path, help="Journal directory, default the app's journal"
+    )
+    common.add_argument(
+        "--storage",
+        choices=("directory", "sqlite"),
+        help="Storage engine, default from the app's settings",
+    )
+    parser = argparse.ArgumentParser(
+        prog="python -m epiccakeking_journal",
+        description="Work with the journal without opening the app",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser(
+        "export", parents=[common], help="Write every day to stdout or a file"
+    )
+    export.add_argument("--format", choices=FORMATS, default="jsonl")
+    export.add_argument("--output", default="-", help="File, or directory for markdown")
+    export.add_argument("--start", type=parse_date, help="First day to export")
+    export.add_argument("--end", type=parse_date, help="Last day to export")
+    export.set_defaults(function=export_command)
+
+    import_ = commands.add_parser(
+        "import",
+        parents=[common],
+        help="Add days from an export, replacing days with the same date",
+    )
+    import_.add_argument("--format", choices=FORMATS, default="jsonl")
+    import_.add_argument("--input", default="-", help="File, or directory for markdown")
+    import_.set_defaults(function=import_command)
+
+    output = argparse.ArgumentParser(add_help=False, parents=[common])
+    output.add_argument(
+        "--json", action="store_true", help="Print one JSON object per line"
+    )
+    search = commands.add_parser(
+        "search",
+        parents=[output],
+        help="Print matching lines, using the app's search language",
+    )
+    search.add_argument("terms", nargs="+")
+    search.add_argument("--limit", type=int, help="Stop after this many lines")
+    search.add_argument(
+        "--ranked", action="store_true", help="Best matches first, with scores"
+    )
+    search.set_defaults(function=search_command)
+
+    stats = commands.add_parser("stats", parents=[output], help="Print totals")
+    stats.set_defaults(function=stats_command)
+
+    top_words = commands.add_parser(
+        "top-words", parents=[output], help="Print the most used words"
+    )
+    top_words.add_argument("-n", "--count", type=int, default=20)
+    top_words.add_argument(
+        "--all",
+        action="store_true",
+        help="Include the words excluded from the word cloud",
+    )
+    top_words.add_argument(
+        "--approximate",
+        action="store_true",
+        help="Estimate counts in bounded memory, for huge journals",
+    )
+    top_words.set_defaults(function=top_words_command)
+
+    month = commands.add_parser(
+        "calendar", parents=[output], help="Show the edited days of a month"
+    )
+    month.add_argument("month", type=parse_month, help="YEAR-MONTH, like 2022-03")
+    month.set_defaults(function=calendar_command)
+
+    pack = commands.add_parser(
+        "pack",
+        parents=[common],
+        help="Compress the days of a past year into one file, for faster startup",
+    )
+    pack.add_argument("year", type=int)
+    pack.set_defaults(function=pack_command)
+    return parser
+
+
+def run_command(argv=None):
+    parser = make_parser()
+    args = parser.parse_args(argv)
+    if instrumentation.enabled_by_environment():
+        instrumentation.recorder.enable(
+            user_dir("XDG_CACHE_HOME", ".cache") / "timings.json"
+        )
+    try:
+        return args.function(args)
+    except BrokenPipeError:
+        # Output was cut short, e.g. by head, so stop quietly
+        os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return 1
+    except (OSError, ValueError, KeyError) as e:
+        print(f"{parser.prog} {args.command}: {e}", file=sys.stderr)
+        return 1
@@ -0,0 +1,202 @@
+"""
+Copyright 2022 epiccakeking
+
+This file is part of epiccakeking_journal.
+
+epiccakeking_journal is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+epiccakeking_journal is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+epiccakeking_journal. If not, see <https://www.gnu.org/licenses/>.
+"""
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque
+
+# Set to anything to record timings, like the instrumentation setting
+ENV_VAR = "JOURNAL_INSTRUMENTATION"
+# Durations kept per name for percentiles
+WINDOW = 1024
+FRAME = 1 / 60
+# Flag of generator functions in code objects, from inspect which is slow to import
+CO_GENERATOR = 0x20
+
+
+class Timing:
+    """Count and rolling percentiles of the durations of one operation"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.recent = deque(maxlen=WINDOW)
+
+    def add(self, seconds):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.recent.append(seconds)
+
+    def summary(self):
+        """Get the statistics in milliseconds, percentiles are of recent durations"""
+        recent = sorted(self.recent)
+        summary = dict(count=self.count, total=self.total * 1000, max=self.max * 1000)
+        for percentile in (50, 90, 99):
+            index = min(len(recent) - 1, len(recent) * percentile // 100)
+            summary[f"p{percentile}"] = recent[index] * 1000
+        return summary
+
+
+class Recorder:
+    """Timings of instrumented operations, nothing is recorded unless enabled"""
+
+    def __init__(self):
+        self.enabled = False
+        self.timings = {}
+        # Recent main loop blocks as dicts of time, duration (ms) and stack
+        self.blocks = deque(maxlen=50)
+        self.lock = threading.Lock()
+
+    def enable(self, dump_path=None):
+        """Start recording, writing the results to dump_path at exit if given"""
+        self.enabled = True
+        if dump_path:
+            atexit.register(self.dump, dump_path)
+
+    def record(self, name, seconds):
+        with self.lock:
+            if name not in self.timings:
+                self.timings[name] = Timing()
+            self.timings[name].add(seconds)
+
+    def block(self, seconds, stack):
+        self.record("main loop block", seconds)
+        with self.lock:
+            self.blocks.append(
+                dict(time=time.time(), duration=seconds * 1000, stack=stack)
+            )
+
+    def summary(self):
+        with self.lock:
+            return {name: self.timings[name].summary() for name in sorted(self.timings)}
+
+    def dump(self, path):
+        blocks = list(self.blocks)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(
+            json.dumps(dict(timings=self.summary(), blocks=blocks), indent=2)
+        )
+        print(f"Timings written to {path}", file=sys.stderr)
+
+
+recorder = Recorder()
+
+
+def enabled_by_environment():
+    return bool(os.environ.get(ENV_VAR))
+
+
+def timed(name):
+    """
+    Decorator recording the duration of each call under name when enabled.
+    For generator functions the time spent producing items is recorded.
+    """
+
+    def decorator(function):
+        if function.__code__.co_flags & CO_GENERATOR:
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not recorder.enabled:
+                    return function(*args, **kwargs)
+                return timed_generator(name, function(*args, **kwargs))
+
+        else:
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not recorder.enabled:
+                    return function(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    recorder.record(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
+
+
+def timed_generator(name, generator):
+    """Yield from generator, recording the time spent inside it once it is done"""
+    spent = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            finally:
+                spent += time.perf_counter() - start
+            yield item
+    finally:
+        generator.close()
+        recorder.record(name, spent)
+
+
+class MainLoopWatchdog:
+    """
+    Flags main loop iterations longer than a frame. A heartbeat runs on the main
+    loop, and a thread records the main thread's stack when the heartbeat is late.
+    """
+
+    INTERVAL = 0.005  # Seconds between heartbeats
+
+    def __init__(self, threshold=FRAME):
+        self.threshold = threshold
+        self.thread_id = None
+        self.last_beat = None
+        # Stack of the block in progress
+        self.stack = None
+
+    def start(self):
+        """Start watching, must be called from the main thread"""
+        from gi.repository import GLib
+
+        self.thread_id = threading.get_ident()
+        self.last_beat = time.perf_counter()
+        GLib.timeout_add(int(self.INTERVAL * 1000), self.beat)
+        threading.Thread(target=self.watch, name="watchdog", daemon=True).start()
+
+    def beat(self):
+        now = time.perf_counter()
+        late = now - self.last_beat - self.INTERVAL
+        self.last_beat = now
+        if self.stack is not None:
+            if late > self.threshold:
+                recorder.block(late, self.stack)
+            self.stack = None
+        return True
+
+    def watch(self):
+        import traceback
+
+        while True:
+            time.sleep(self.threshold / 2)
+            late = time.perf_counter() - self.last_beat - self.INTERVAL
+            if self.stack is None and late > self.threshold:
+                frame = sys._current_frames().get(self.thread_id)
+                self.stack = "".join(traceback.format_stack(frame)) if frame else ""
@@ -15,10 +15,11 @@ FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more de
 You should have received a copy of the GNU General Public License along with
 epiccakeking_journal. If not, see <https://www.gnu.org/licenses/>.
 """
-from gi.repository import Gtk
+from gi.repository import Gtk, GLib
 
+from epiccakeking_journal.instrumentation import recorder
 from epiccakeking_journal.utilities import templated
-from epiccakeking_journal.widgets import SearchResult, SetManager
+from epiccakeking_journal.widgets import SearchResults, SetManager
 
 
 @templated
@@ -27,17 +28,24 @@ class SearchModal(Gtk.Dialog):
     search = Gtk.Template.Child("search")
     results_scroller = Gtk.Template.Child("results_scroller")
 
+    results = None
+
     def __init__(self, parent):
         super().__init__(modal=True, transient_for=parent)
         self.parent = parent
         self.search.connect("activate", self.on_search)
+        self.connect("close-request", self.on_close_request)
         self.present()
 
     def on_search(self, *_):
-        result_box = Gtk.Box(orientation=1, vexpand=True)
-        for result in self.parent.backend.search(self.search.get_text()):
-            result_box.append(SearchResult(self, *result))
-        self.results_scroller.set_child(result_box)
+        if self.results:
+            self.results.cancel()
+        self.results = SearchResults(self, self.parent.backend, self.search.get_text())
+        self.results_scroller.set_child(self.results)
+
+    def on_close_request(self, *_):
+        if self.results:
+            self.results.cancel()
 
     def change_day(self, date):
         self.parent.change_day(date)
@@ -63,6 +71,9 @@ class SettingsModal(Gtk.Window):
     __gtype_name__ = "SettingsModal"
     date_format = Gtk.Template.Child("date_format")
     alt_gui = Gtk.Template.Child("alt_gui")
+    sqlite_storage = Gtk.Template.Child("sqlite_storage")
+    instrumentation = Gtk.Template.Child("instrumentation")
+    approximate_word_cloud = Gtk.Template.Child("approximate_word_cloud")
     stack = Gtk.Template.Child("stack")
     back = Gtk.Template.Child("back")
     word_cloud_exclusions_button = Gtk.Template.Child("word_cloud_exclusions_button")
@@ -76,6 +87,11 @@ class SettingsModal(Gtk.Window):
         self.date_format.set_text(self.parent.settings.get("date_format"))
         self.alt_gui.set_active(self.parent.settings.get("alt_gui"))
         self.alt_gui.set_active(self.parent.settings.get("alt_gui"))
+        self.sqlite_storage.set_active(self.parent.settings.get("storage") == "sqlite")
+        self.instrumentation.set_active(self.parent.settings.get("instrumentation"))
+        self.approximate_word_cloud.set_active(
+            self.parent.settings.get("approximate_word_cloud")
+        )
         self.word_cloud_exclusions = self.parent.settings.get("word_cloud_exclusions")
         self.connect("close-request", self.on_close_request)
         self.back.connect("clicked", self.back_stack)
@@ -98,10 +114,19 @@ class SettingsModal(Gtk.Window):
             return True
 
     def save_changes(self):
+        storage = "sqlite" if self.sqlite_storage.get_active() else "directory"
+        # Copy the journal over first, so a failure leaves the setting unchanged
+        if storage != self.parent.settings.get(
+            "storage"
+        ) and not self.parent.change_storage(storage):
+            storage = self.parent.settings.get("storage")
         self.parent.settings.set(
             date_format=self.date_format.get_text(),
             alt_gui=self.alt_gui.get_active(),
             word_cloud_exclusions=self.word_cloud_exclusions,
+            storage=storage,
+            instrumentation=self.instrumentation.get_active(),
+            approximate_word_cloud=self.approximate_word_cloud.get_active(),
         )
 
     def back_stack(self, *_):
@@ -138,19 +163,9 @@ class StatsModal(Gtk.Dialog):
         self.present()
 
     def update(self):
-        characters = 0
-        words = 0
-        lines = 0
-        for day in self.parent.backend.get_edited_days():
-            if day == self.parent.page.date:
-                continue
-            data = self.parent.backend.get_day(day)
-            characters += len(data)
-            words += len(data.split())
-            lines += data.count("\n") + 1
-        self.characters = characters
-        self.words = words
-        self.lines = lines
+        self.characters, self.words, self.lines = self.parent.backend.stats(
+            exclude=(self.parent.page.date,)
+        )
         self.update_current()
 
     def update_current(self):
@@ -177,6 +192,43 @@ Lines: {self.lines + self.current_lines}
         )
 
 
+class TimingsModal(Gtk.Dialog):
+    """Shows the instrumentation timings, updated every second"""
+
+    def __init__(self, parent):
+        super().__init__(transient_for=parent, title="Timings")
+        self.label = Gtk.Label(xalign=0, yalign=0, selectable=True)
+        self.label.add_css_class("monospace")
+        self.set_child(
+            Gtk.ScrolledWindow(
+                child=self.label, min_content_width=700, min_content_height=400
+            )
+        )
+        self.update()
+        self.source = GLib.timeout_add_seconds(1, self.update)
+        self.connect("close-request", self.on_close_request)
+        self.present()
+
+    def on_close_request(self, *_):
+        GLib.source_remove(self.source)
+
+    def update(self):
+        lines = [
+            f"{'Milliseconds':<32}{'count':>8}{'p50':>9}{'p90':>9}{'p99':>9}{'max':>9}"
+        ]
+        for name, timing in recorder.summary().items():
+            lines.append(
+                f"{name:<32}{timing['count']:>8}"
+                + "".join(f"{timing[x]:>9.2f}" for x in ("p50", "p90", "p99", "max"))
+            )
+        if recorder.blocks:
+            block = recorder.blocks[-1]
+            lines.append(f"\nLast main loop block, {block['duration']:.1f} ms:")
+            lines.append(block["stack"])
+        self.label.set_label("\n".join(lines))
+        return True
+
+
 class ErrorDialog(Gtk.Dialog):
     def __init__(self, parent, text):
         super().__init__(modal=True, transient_for=parent, title="Error")
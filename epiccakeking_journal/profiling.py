@@ -0,0 +1,57 @@
+"""
+Copyright 2022 epiccakeking
+
+This file is part of epiccakeking_journal.
+
+epiccakeking_journal is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+epiccakeking_journal is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+epiccakeking_journal. If not, see <https://www.gnu.org/licenses/>.
+"""
+import sys
+import time
+from contextlib import contextmanager
+
+
+class StartupProfile:
+    """Records how long each phase of startup takes, reported by finish"""
+
+    def __init__(self, enabled=False):
+        self.enabled = enabled
+        self.start = time.perf_counter()
+        self.phases = []
+        self.finished = False
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.phases.append((name, time.perf_counter() - start))
+
+    def mark(self, name):
+        """Record a point in time, as a phase lasting since the previous one ended"""
+        self.phases.append((name, time.perf_counter() - self.start - self.elapsed()))
+
+    def elapsed(self):
+        return sum(x[1] for x in self.phases)
+
+    def finish(self):
+        """Print the report, only the first call does anything"""
+        if not self.enabled or self.finished:
+            return
+        self.finished = True
+        for name, seconds in self.phases:
+            print(f"{name}: {seconds * 1000:.1f} ms", file=sys.stderr)
+        print(
+            f"total: {(time.perf_counter() - self.start) * 1000:.1f} ms",
+            file=sys.stderr,
+        )
@@ -0,0 +1,285 @@
+"""
+Copyright 2022 epiccakeking
+
+This file is part of epiccakeking_journal.
+
+epiccakeking_journal is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+epiccakeking_journal is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+epiccakeking_journal. If not, see <https://www.gnu.org/licenses/>.
+
+Search query language.
+
+Terms on a line must all match unless joined with OR, and NOT negates the term
+after it. Parentheses group terms.
+    word            Lines containing word, ignoring case
+    "some words"    Lines containing the exact phrase, ignoring case
+    /regex/         Lines matching the regular expression, ignoring case
+    date:2021-03..2021-06
+                    Days in a range, either side can be a year, month or day
+                    and may be left out. date:2021 is the whole of 2021.
+"""
+import calendar
+import datetime
+import io
+import re
+
+TOKEN_RE = re.compile(
+    r"""\s*(?:
+        (?P<paren>[()])
+        | "(?P<phrase>[^"]*)"?
+        | /(?P<regex>(?:[^/\\]|\\.)*)/
+        | (?P<word>[^\s()]+)
+    )""",
+    re.VERBOSE,
+)
+
+
+class QueryError(ValueError):
+    pass
+
+
+class Node:
+    def match(self, date, line, lower):
+        """Whether line (lower is line.lower()) on date matches"""
+        raise NotImplementedError
+
+    def date_range(self):
+        """(start, end) bounds of the dates which can match, None is unbounded"""
+        return None, None
+
+    def candidate_days(self, backend):
+        """The set of ISO dates which can match, None if unknown"""
+        return None
+
+
+class Term(Node):
+    def __init__(self, text):
+        self.text = text.lower()
+
+    def match(self, date, line, lower):
+        return self.text in lower
+
+    def candidate_days(self, backend):
+        return backend.term_days(self.text)
+
+
+class Regex(Node):
+    def __init__(self, pattern):
+        try:
+            self.pattern = re.compile(pattern, re.IGNORECASE)
+        except re.error as e:
+            raise QueryError(f"Invalid regex /{pattern}/: {e}") from e
+
+    def match(self, date, line, lower):
+        return bool(self.pattern.search(line))
+
+
+class DateRange(Node):
+    def __init__(self, start, end):
+        self.start = start
+        self.end = end
+
+    def match(self, date, line, lower):
+        return (self.start is None or date >= self.start) and (
+            self.end is None or date <= self.end
+        )
+
+    def date_range(self):
+        return self.start, self.end
+
+
+class And(Node):
+    def __init__(self, children):
+        self.children = children
+
+    def match(self, date, line, lower):
+        return all(x.match(date, line, lower) for x in self.children)
+
+    def date_range(self):
+        start = end = None
+        for child_start, child_end in (x.date_range() for x in self.children):
+            if child_start is not None and (start is None or child_start > start):
+                start = child_start
+            if child_end is not None and (end is None or child_end < end):
+                end = child_end
+        return start, end
+
+    def candidate_days(self, backend):
+        result = None
+        for child in self.children:
+            days = child.candidate_days(backend)
+            if days is not None:
+                result = days if result is None else result & days
+        return result
+
+
+class Or(Node):
+    def __init__(self, children):
+        self.children = children
+
+    def match(self, date, line, lower):
+        return any(x.match(date, line, lower) for x in self.children)
+
+    def date_range(self):
+        ranges = [x.date_range() for x in self.children]
+        starts = [x[0] for x in ranges]
+        ends = [x[1] for x in ranges]
+        return (
+            None if None in starts else min(starts),
+            None if None in ends else max(ends),
+        )
+
+    def candidate_days(self, backend):
+        result = set()
+        for child in self.children:
+            days = child.candidate_days(backend)
+            if days is None:
+                return None
+            result |= days
+        return result
+
+
+class Not(Node):
+    def __init__(self, child):
+        self.child = child
+
+    def match(self, date, line, lower):
+        return not self.child.match(date, line, lower)
+
+
+def parse_date(text, end):
+    """Parse a year, month or day, giving the last day of the period if end is true"""
+    try:
+        parts = [int(x) for x in text.split("-")]
+        if len(parts) == 3:
+            return datetime.date(*parts)
+        if len(parts) == 2:
+            day = calendar.monthrange(*parts)[1] if end else 1
+            return datetime.date(*parts, day)
+        if len(parts) == 1:
+            return (
+                datetime.date(parts[0], 12, 31)
+                if end
+                else datetime.date(parts[0], 1, 1)
+            )
+    except ValueError:
+        pass
+    raise QueryError(f"Invalid date {text!r}")
+
+
+def parse_date_range(text):
+    start, dots, end = text.partition("..")
+    if not dots:
+        end = start
+    return DateRange(
+        parse_date(start, False) if start else None,
+        parse_date(end, True) if end else None,
+    )
+
+
+class Query:
+    """A parsed query, compiled once and run against any backend"""
+
+    def __init__(self, text):
+        self.tokens = self.tokenize(text)
+        self.position = 0
+        self.root = self.parse_or() if self.tokens else And([])
+        if self.position < len(self.tokens):
+            raise QueryError("Unexpected )")
+        self.start, self.end = self.root.date_range()
+
+    @staticmethod
+    def tokenize(text):
+        tokens = []
+        position = 0
+        text = text.rstrip()
+        while position < len(text):
+            match = TOKEN_RE.match(text, position)
+            position = match.end()
+            kind = match.lastgroup
+            tokens.append((kind, match.group(kind)))
+        return tokens
+
+    def peek(self):
+        if self.position < len(self.tokens):
+            return self.tokens[self.position]
+        return None, None
+
+    def parse_or(self):
+        children = [self.parse_and()]
+        while self.peek() == ("word", "OR"):
+            self.position += 1
+            children.append(self.parse_and())
+        return children[0] if len(children) == 1 else Or(children)
+
+    def parse_and(self):
+        children = [self.parse_not()]
+        while self.peek()[0] is not None and self.peek() not in (
+            ("paren", ")"),
+            ("word", "OR"),
+        ):
+            if self.peek() == ("word", "AND"):
+                self.position += 1
+            children.append(self.parse_not())
+        return children[0] if len(children) == 1 else And(children)
+
+    def parse_not(self):
+        if self.peek() == ("word", "NOT"):
+            self.position += 1
+            return Not(self.parse_not())
+        return self.parse_atom()
+
+    def parse_atom(self):
+        kind, value = self.peek()
+        self.position += 1
+        if kind is None:
+            raise QueryError("Unexpected end of query")
+        if kind == "paren":
+            if value == ")":
+                raise QueryError("Unexpected )")
+            node = self.parse_or()
+            if self.peek() != ("paren", ")"):
+                raise QueryError("Missing )")
+            self.position += 1
+            return node
+        if kind == "phrase":
+            return Term(value)
+        if kind == "regex":
+            return Regex(value)
+        if value.startswith("date:"):
+            return parse_date_range(value[5:])
+        return Term(value)
+
+    def search(self, backend, cancelled=None):
+        """
+        Yield (date, line_number, line_content) for matching lines in date order.
+        Stops early once the cancelled Event, if given, is set.
+        """
+        if isinstance(self.root, Term):
+            # The backend's own search has faster ways to find a single term
+            yield from backend.search(self.root.text, cancelled)
+            return
+        candidates = self.root.candidate_days(backend)
+        if candidates is None:
+            days = backend.get_edited_days(self.start, self.end)
+        else:
+            days = sorted(
+                day
+                for day in map(datetime.date.fromisoformat, candidates)
+                if (self.start is None or day >= self.start)
+                and (self.end is None or day <= self.end)
+            )
+        for day in days:
+            if cancelled is not None and cancelled.is_set():
+                return
+            for i, line in enumerate(io.StringIO(backend.get_day(day))):
+                if self.root.match(day, line, line.lower()):
+                    yield day, i, line
@@ -0,0 +1,104 @@
+"""
+Copyright 2022 epiccakeking
+
+This file is part of epiccakeking_journal.
+
+epiccakeking_journal is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+epiccakeking_journal is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+epiccakeking_journal. If not, see <https://www.gnu.org/licenses/>.
+"""
+import hashlib
+import heapq
+import random
+from array import array
+
+# Prime for the row hashes, larger than any index
+PRIME = 2**61 - 1
+
+
+class CountMinSketch:
+    """
+    Approximate counts of a stream in fixed memory.
+    Estimates are never below the true count, and are above it by at most
+    a small fraction of the stream's total with high probability.
+    """
+
+    def __init__(self, width=2**16, depth=4):
+        self.width = width
+        self.rows = [array("q", bytes(8 * width)) for _ in range(depth)]
+        # Each row maps an item's hash h to (a * h + b) % PRIME % width, with its own
+        # a and b, so items colliding in one row are unlikely to collide in others.
+        # Seeded so that sketches of the same size can be combined or saved.
+        generator = random.Random(depth)
+        self.salts = [
+            (generator.randrange(1, PRIME), generator.randrange(PRIME))
+            for _ in range(depth)
+        ]
+
+    def indexes(self, item):
+        h = int.from_bytes(
+            hashlib.blake2b(item.encode(), digest_size=8).digest(), "little"
+        )
+        return [(a * h + b) % PRIME % self.width for a, b in self.salts]
+
+    def add(self, item, count=1):
+        """Add count to item, returning its new estimate"""
+        estimate = None
+        for row, i in zip(self.rows, self.indexes(item)):
+            row[i] += count
+            if estimate is None or row[i] < estimate:
+                estimate = row[i]
+        return estimate
+
+    def estimate(self, item):
+        return min(row[i] for row, i in zip(self.rows, self.indexes(item)))
+
+
+class HeavyHitters:
+    """
+    The most frequent items of a stream with approximate counts, in memory bounded
+    by the sketch and the number of candidates kept rather than by the vocabulary.
+    Counts can be taken out again by adding negative counts.
+    """
+
+    def __init__(self, capacity=1000, width=2**16, depth=4):
+        self.sketch = CountMinSketch(width, depth)
+        # Items which may be among the top capacity, with their estimates
+        self.capacity = capacity
+        self.candidates = {}
+
+    def add(self, item, count=1):
+        estimate = self.sketch.add(item, count)
+        if estimate > 0:
+            self.candidates[item] = estimate
+        else:
+            self.candidates.pop(item, None)
+        if len(self.candidates) > 2 * self.capacity:
+            self.candidates = dict(self.top(self.capacity))
+
+    def top(self, k, exclude=()):
+        """Get the k items not in exclude with the highest estimates, with them"""
+        return heapq.nlargest(
+            k,
+            (x for x in self.candidates.items() if x[0] not in exclude),
+            key=lambda x: x[1],
+        )
+
+    def to_bytes(self):
+        return b"".join(row.tobytes() for row in self.sketch.rows)
+
+    def from_bytes(self, data):
+        """Load sketch rows saved by to_bytes from a sketch of the same size"""
+        size = 8 * self.sketch.width
+        if len(data) != size * len(self.sketch.rows):
+            raise ValueError("Sketch size doesn't match")
+        for i, row in enumerate(self.sketch.rows):
+            self.sketch.rows[i] = array("q", data[i * size : (i + 1) * size])
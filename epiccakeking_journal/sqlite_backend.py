@@ -0,0 +1,282 @@
+"""
+Copyright 2022 epiccakeking
+
+This file is part of epiccakeking_journal.
+
+epiccakeking_journal is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+epiccakeking_journal is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+epiccakeking_journal. If not, see <https://www.gnu.org/licenses/>.
+"""
+import datetime
+import io
+import sqlite3
+import threading
+from pathlib import Path
+
+from epiccakeking_journal.backend import (
+    LineMatcher,
+    count_stats,
+    count_words,
+    rank_search,
+)
+from epiccakeking_journal.instrumentation import timed
+from epiccakeking_journal.query import Query
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS days (
+    date TEXT PRIMARY KEY,
+    content TEXT NOT NULL,
+    characters INTEGER NOT NULL,
+    words INTEGER NOT NULL,
+    lines INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS day_words (
+    date TEXT NOT NULL,
+    word TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (date, word)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS word_totals (
+    word TEXT PRIMARY KEY,
+    count INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE VIRTUAL TABLE IF NOT EXISTS lines USING fts5(
+    date UNINDEXED, line_number UNINDEXED, content, tokenize="trigram"
+);
+"""
+
+
+class SqliteBackend:
+    """Stores the whole journal in one SQLite database, with the same API as Backend"""
+
+    SEARCH_PAGE_SIZE = 64  # Days read at a time by search
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # Searches run on worker threads, so share one connection behind a lock
+        self.lock = threading.RLock()
+        self.db = sqlite3.connect(self.path, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    @timed("SqliteBackend.get_day")
+    def get_day(self, date):
+        with self.lock:
+            row = self.db.execute(
+                "SELECT content FROM days WHERE date = ?", (date.isoformat(),)
+            ).fetchone()
+        return row[0] if row else ""
+
+    def month_edited_days(self, date):
+        return sorted(self.edited_days_by_month(date, date)[date.year, date.month])
+
+    def edited_days_by_month(self, start, end):
+        """
+        Get the edited days of every month from start to end (inclusive)
+        as {(year, month): {day, ...}}. The day of start and end is ignored.
+        """
+        months = {}
+        year, month = start.year, start.month
+        while (year, month) <= (end.year, end.month):
+            months[year, month] = set()
+            year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT date FROM days WHERE date >= ? AND date < ?",
+                (f"{start.year:04}-{start.month:02}", f"{year:04}-{month:02}"),
+            ).fetchall()
+        for (key,) in rows:
+            day = datetime.date.fromisoformat(key)
+            months[day.year, day.month].add(day.day)
+        return months
+
+    @timed("SqliteBackend.save_day")
+    def save_day(self, date, data):
+        with self.lock, self.db:
+            self.write_day(date.isoformat(), data)
+        return True
+
+    def save_days(self, days):
+        """Write many (date, content) pairs in one transaction, returns how many changed"""
+        with self.lock, self.db:
+            return sum(self.write_day(date.isoformat(), data) for date, data in days)
+
+    def write_day(self, key, data):
+        """Replace a day inside a transaction, returns whether it changed"""
+        row = self.db.execute(
+            "SELECT content FROM days WHERE date = ?", (key,)
+        ).fetchone()
+        if (row[0] if row else "") == data:
+            return False
+        if row:
+            self.db.execute(
+                """UPDATE word_totals SET count = count - (
+                    SELECT count FROM day_words
+                    WHERE day_words.date = ? AND day_words.word = word_totals.word
+                ) WHERE word IN (SELECT word FROM day_words WHERE date = ?)""",
+                (key, key),
+            )
+            self.db.execute("DELETE FROM word_totals WHERE count <= 0")
+            for table in ("days", "day_words", "lines"):
+                self.db.execute(f"DELETE FROM {table} WHERE date = ?", (key,))
+        # For consistency empty days aren't stored
+        if not data:
+            return True
+        self.db.execute(
+            "INSERT INTO days VALUES (?, ?, ?, ?, ?)",
+            (key, data, *count_stats(data)),
+        )
+        words = count_words(data)
+        self.db.executemany(
+            "INSERT INTO day_words VALUES (?, ?, ?)",
+            ((key, word, count) for word, count in words.items()),
+        )
+        self.db.executemany(
+            """INSERT INTO word_totals VALUES (?, ?)
+            ON CONFLICT (word) DO UPDATE SET count = count + excluded.count""",
+            words.items(),
+        )
+        self.db.executemany(
+            "INSERT INTO lines VALUES (?, ?, ?)",
+            ((key, i, line) for i, line in enumerate(io.StringIO(data))),
+        )
+        return True
+
+    @timed("SqliteBackend.get_edited_days")
+    def get_edited_days(self, start=None, end=None, reverse=False, limit=None):
+        """
+        Yield edited days in chronological order, or newest first if reverse.
+        Only days from start to end (inclusive) are given, up to limit days.
+        """
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT date FROM days WHERE date >= ? AND date <= ?"
+                f" ORDER BY date {'DESC' if reverse else 'ASC'} LIMIT ?",
+                (
+                    start.isoformat() if start else "",
+                    end.isoformat() if end else "9",
+                    -1 if limit is None else limit,
+                ),
+            ).fetchall()
+        for (key,) in rows:
+            yield datetime.date.fromisoformat(key)
+
+    def word_frequencies(self, exclude=()):
+        """Get (word, count) tuples for every word used, except those in exclude"""
+        exclude = set(exclude)
+        with self.lock:
+            rows = self.db.execute("SELECT word, count FROM word_totals").fetchall()
+        return [(word, count) for word, count in rows if word not in exclude]
+
+    def top_words(self, k, exclude=(), approximate=False):
+        """Get the k most used words not in exclude, the database needs no estimates"""
+        exclude = list(exclude)
+        with self.lock:
+            return self.db.execute(
+                "SELECT word, count FROM word_totals "
+                f"WHERE word NOT IN ({', '.join('?' * len(exclude))}) "
+                "ORDER BY count DESC LIMIT ?",
+                (*exclude, k),
+            ).fetchall()
+
+    def stats(self, exclude=()):
+        """Get the total (characters, words, lines) of all days not in exclude"""
+        exclude = [day.isoformat() for day in exclude]
+        with self.lock:
+            row = self.db.execute(
+                "SELECT SUM(characters), SUM(words), SUM(lines) FROM days "
+                f"WHERE date NOT IN ({', '.join('?' * len(exclude))})",
+                exclude,
+            ).fetchone()
+        return tuple(x or 0 for x in row)
+
+    def add_listener(self, listener):
+        """Only one instance can use a database at a time, so nothing changes outside"""
+
+    def watch(self):
+        return None
+
+    def get_day_stats(self, date):
+        """Get the (characters, words, lines) of a day"""
+        with self.lock:
+            row = self.db.execute(
+                "SELECT characters, words, lines FROM days WHERE date = ?",
+                (date.isoformat(),),
+            ).fetchone()
+        return row or (0, 0, 0)
+
+    def ranked_search(self, term, k=50, recency=0.0):
+        """Get the best k results of search(term) with scores, see rank_search"""
+        return rank_search(self, term, k, recency)
+
+    @staticmethod
+    def match_phrase(term):
+        """FTS5 query for lines containing term"""
+        return '"' + term.replace('"', '""') + '"'
+
+    def query(self, text, cancelled=None):
+        """
+        Search with the query language described in epiccakeking_journal.query.
+        Results are the same tuples as search, raises QueryError for invalid queries.
+        """
+        return Query(text).search(self, cancelled)
+
+    def term_days(self, term):
+        """Get the ISO dates of days which may contain term, None if it could be any"""
+        # The trigram index can only find terms of at least 3 characters
+        if len(term) < 3:
+            return None
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT DISTINCT date FROM lines WHERE content MATCH ?",
+                (self.match_phrase(term),),
+            ).fetchall()
+        return {key for (key,) in rows}
+
+    @timed("SqliteBackend.search")
+    def search(self, term, cancelled=None):
+        """
+        Each result will be yielded as a tuple: (date, line_number, line_content)
+        Stops early once the cancelled Event, if given, is set.
+        """
+        candidates = self.term_days(term)
+        if candidates is not None:
+            candidates = sorted(candidates)
+        matcher = LineMatcher(term)
+        last_key = ""
+        # Read a page of days at a time, so results arrive as they are found and
+        # saves aren't kept waiting for the lock
+        while True:
+            with self.lock:
+                if candidates is None:
+                    rows = self.db.execute(
+                        "SELECT date, content FROM days WHERE date > ?"
+                        " ORDER BY date LIMIT ?",
+                        (last_key, self.SEARCH_PAGE_SIZE),
+                    ).fetchall()
+                else:
+                    page = candidates[: self.SEARCH_PAGE_SIZE]
+                    del candidates[: self.SEARCH_PAGE_SIZE]
+                    rows = self.db.execute(
+                        "SELECT date, content FROM days"
+                        f" WHERE date IN ({', '.join('?' * len(page))}) ORDER BY date",
+                        page,
+                    ).fetchall()
+            # Candidates may have been deleted since, so only stop once all are read
+            if not rows and not candidates:
+                return
+            for key, content in rows:
+                if cancelled is not None and cancelled.is_set():
+                    return
+                for i, line in matcher(content):
+                    yield datetime.date.fromisoformat(key), i, line
+                last_key = key
@@ -15,24 +15,42 @@ FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more de
 You should have received a copy of the GNU General Public License along with
 epiccakeking_journal. If not, see <https://www.gnu.org/licenses/>.
 """
-import string
+from importlib.resources import files
 
-from gi.repository import Gtk
-from pkg_resources import resource_string
+from gi.repository import Gio, Gtk
 
-letters = set(string.ascii_letters)
+# Kept here for compatibility, the backend needs it without loading Gtk
+from epiccakeking_journal.backend import strip_non_letters  # noqa: F401
 
+RESOURCE_PREFIX = "/io/github/epiccakeking/Journal"
 
-def strip_non_letters(s):
-    for start, c in enumerate(s):
-        if c in letters:
-            break
-    for end in range(len(s) - 1, start - 1, -1):
-        if s[end] in letters:
-            end += 1
-            break
-    return s[start:end]
+
+def register_resources():
+    """
+    Register the compiled resource bundle if it was built.
+    Returns False when running from loose files, like in development.
+    """
+    bundle = files(__package__).joinpath("journal.gresource")
+    if not bundle.is_file():
+        return False
+    # Loading by path lets GLib map the file instead of copying it
+    Gio.Resource.load(str(bundle))._register()
+    return True
+
+
+HAVE_RESOURCES = register_resources()
+
+
+def read_resource(name):
+    """Get the bytes of a file in the ui or css directory, such as css/main.css"""
+    if HAVE_RESOURCES:
+        return Gio.resources_lookup_data(
+            f"{RESOURCE_PREFIX}/{name}", Gio.ResourceLookupFlags.NONE
+        ).get_data()
+    return files(__package__).joinpath(name).read_bytes()
 
 
 def templated(c):
-    return Gtk.Template(string=resource_string(__name__, f"ui/{c.__name__}.ui"))(c)
+    if HAVE_RESOURCES:
+        return Gtk.Template(resource_path=f"{RESOURCE_PREFIX}/ui/{c.__name__}.ui")(c)
+    return Gtk.Template(string=read_resource(f"ui/{c.__name__}.ui").decode())(c)
@@ -0,0 +1,101 @@
+"""
+Copyright 2022 epiccakeking
+
+This file is part of epiccakeking_journal.
+
+epiccakeking_journal is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+epiccakeking_journal is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+epiccakeking_journal. If not, see <https://www.gnu.org/licenses/>.
+"""
+import datetime
+from pathlib import Path
+
+from gi.repository import Gio
+
+
+class JournalWatcher:
+    """
+    Watches a journal directory for changes made outside the app,
+    calling callback(date) on the main loop for each day file changed.
+    """
+
+    EVENTS = {
+        Gio.FileMonitorEvent.CHANGES_DONE_HINT,
+        Gio.FileMonitorEvent.CREATED,
+        Gio.FileMonitorEvent.DELETED,
+        Gio.FileMonitorEvent.MOVED_IN,
+        Gio.FileMonitorEvent.MOVED_OUT,
+        Gio.FileMonitorEvent.RENAMED,
+    }
+
+    def __init__(self, path, callback):
+        self.path = Path(path)
+        self.callback = callback
+        # File monitors aren't recursive, so the root, years and months are watched
+        self.monitors = {}
+        self.watch(self.path)
+        if self.path.is_dir():
+            for year in self.path.iterdir():
+                if self.depth(year) == 1 and year.is_dir():
+                    self.watch(year)
+                    for month in year.iterdir():
+                        if self.depth(month) == 2 and month.is_dir():
+                            self.watch(month)
+
+    def watch(self, path):
+        if path in self.monitors:
+            return
+        monitor = Gio.File.new_for_path(str(path)).monitor_directory(
+            Gio.FileMonitorFlags.WATCH_MOVES, None
+        )
+        monitor.connect("changed", self.on_changed)
+        self.monitors[path] = monitor
+
+    def cancel(self):
+        for monitor in self.monitors.values():
+            monitor.cancel()
+        self.monitors.clear()
+
+    def depth(self, path):
+        """Get how many levels below the journal path is if it has a numeric name"""
+        try:
+            relative = path.relative_to(self.path)
+        except ValueError:
+            return None
+        if not all(x.isascii() and x.isdigit() for x in relative.parts):
+            return None
+        return len(relative.parts)
+
+    def on_changed(self, _monitor, file, other_file, event):
+        if event not in self.EVENTS:
+            return
+        for changed in (file, other_file):
+            if changed is None or changed.get_path() is None:
+                continue
+            path = Path(changed.get_path())
+            depth = self.depth(path)
+            if depth in (1, 2) and event != Gio.FileMonitorEvent.DELETED:
+                # A new year or month directory, which may already have days in it
+                if path.is_dir():
+                    self.watch(path)
+                    for child in path.iterdir():
+                        self.on_changed(
+                            None,
+                            Gio.File.new_for_path(str(child)),
+                            None,
+                            Gio.FileMonitorEvent.CREATED,
+                        )
+            elif depth == 3:
+                try:
+                    date = datetime.date(*(int(x) for x in path.parts[-3:]))
+                except ValueError:
+                    continue
+                self.callback(date)
@@ -15,8 +15,16 @@ FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more de
 You should have received a copy of the GNU General Public License along with
 epiccakeking_journal. If not, see <https://www.gnu.org/licenses/>.
 """
-from gi.repository import Gtk, GLib
+import heapq
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
 
+from gi.repository import Gtk, GLib, Gio, GObject
+
+from epiccakeking_journal.instrumentation import timed
+from epiccakeking_journal.query import QueryError
 from epiccakeking_journal.utilities import templated
 
 
@@ -80,18 +88,96 @@ class SearchResult(Gtk.Button):
     date_label = Gtk.Template.Child("date_label")
     preview = Gtk.Template.Child()
 
-    def __init__(self, parent, date, line_number, text):
+    date = None
+
+    def __init__(self, parent):
         super().__init__()
         self.parent = parent
-        self.date = date
         self.connect("clicked", self.on_click)
-        self.date_label.set_label(date.isoformat() + ": ")
-        self.preview.set_label(text.rstrip())
+
+    def set_hit(self, hit):
+        self.date = hit.date
+        self.date_label.set_label(hit.date.isoformat() + ": ")
+        self.preview.set_label(hit.text.rstrip())
 
     def on_click(self, *_):
         self.parent.change_day(self.date)
 
 
+class SearchHit(GObject.Object):
+    """A search result, as an object which can be put in a Gio.ListStore"""
+
+    def __init__(self, date, line_number, text):
+        super().__init__()
+        self.date = date
+        self.line_number = line_number
+        self.text = text
+
+
+class SearchResults(Gtk.ListView):
+    """
+    Shows the results of a search as they are found by a worker thread.
+    Rows are only created for the visible results and are reused when scrolling.
+    """
+
+    BATCH_SIZE = 100
+    BATCH_INTERVAL = 0.05  # Seconds
+
+    def __init__(self, parent, backend, term):
+        """
+        :param parent: Object with a change_day method, called when a result is clicked
+        """
+        super().__init__(vexpand=True)
+        self.parent = parent
+        self.store = Gio.ListStore.new(SearchHit)
+        self.set_model(Gtk.NoSelection.new(self.store))
+        factory = Gtk.SignalListItemFactory()
+        factory.connect("setup", self.on_setup)
+        factory.connect("bind", self.on_bind)
+        self.set_factory(factory)
+        self.cancelled = threading.Event()
+        threading.Thread(target=self.run, args=(backend, term), daemon=True).start()
+
+    def cancel(self):
+        """Stop the search, results already found are kept"""
+        self.cancelled.set()
+
+    def run(self, backend, term):
+        try:
+            results = backend.query(term, self.cancelled)
+        except QueryError:
+            # Probably not meant as a query, e.g. an unmatched parenthesis
+            results = backend.search(term, self.cancelled)
+        batch = []
+        last_send = time.monotonic()
+        for result in results:
+            if self.cancelled.is_set():
+                return
+            batch.append(result)
+            if (
+                len(batch) >= self.BATCH_SIZE
+                or time.monotonic() - last_send > self.BATCH_INTERVAL
+            ):
+                GLib.idle_add(self.add_results, batch)
+                batch = []
+                last_send = time.monotonic()
+        if batch:
+            GLib.idle_add(self.add_results, batch)
+
+    def add_results(self, results):
+        if not self.cancelled.is_set():
+            self.store.splice(
+                self.store.get_n_items(), 0, [SearchHit(*x) for x in results]
+            )
+        return False
+
+    def on_setup(self, _factory, list_item):
+        list_item.set_child(SearchResult(self.parent))
+
+    def on_bind(self, _factory, list_item):
+        list_item.get_child().set_hit(list_item.get_item())
+
+
 class WordCloud(Gtk.ScrolledWindow):
     MAX_WORDS = 50
 
@@ -107,8 +193,7 @@ class WordCloud(Gtk.ScrolledWindow):
     def load(self, frequency_data):
         box = Gtk.TextView(wrap_mode=2, editable=False, cursor_visible=False)
         buffer = box.get_buffer()
-        words = sorted(frequency_data, key=lambda x: x[1], reverse=True)
-        words = words[: self.MAX_WORDS]
+        words = heapq.nlargest(self.MAX_WORDS, frequency_data, key=lambda x: x[1])
         avg = sum(x[1] ** 0.5 for x in words) / (len(words) or 1)
         words.sort(key=lambda x: x[0])
         for word, count in words:
@@ -128,11 +213,7 @@ class WordCloud(Gtk.ScrolledWindow):
     @classmethod
     def from_string(cls, s):
         """Generate a word cloud from a string"""
-        word_dict = {}
-        for word in s.split():
-            word_dict.setdefault(word, 0)
-            word_dict[word] += 1
-        return cls(word_dict.items())
+        return cls(Counter(s.split()).items())
 
     def on_button_press(self, *_):
         print(*_)
@@ -146,23 +227,120 @@ class WordCloud(Gtk.ScrolledWindow):
         return f
 
 
+class Formatter:
+    """
+    Applies the journal formatting tags to a Gtk.TextBuffer.
+    Edits only re-tag the lines they touch, continuing further only while
+    the code block state at the start of the following lines changes.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.tags = {
+            "title": buffer.create_tag("title", foreground="pink", font="Sans 20"),
+            "bullet": buffer.create_tag("bullet", foreground="green"),
+            "code": buffer.create_tag("code", font="Monospace"),
+            "rule": buffer.create_tag("rule", foreground="green"),
+        }
+        # Whether each line starts inside a code block, plus one entry for the end
+        # None means unknown.
+        self.code_states = [False, None]
+        # (first, last) lines changed since the last format
+        self.dirty = None
+        buffer.connect("insert-text", self.on_insert_text)
+        buffer.connect("delete-range", self.on_delete_range)
+        buffer.connect("changed", self.on_changed)
+        self.format()
+
+    def format(self):
+        """Re-tag the whole buffer"""
+        self.dirty = None
+        self.code_states = [False] + [None] * self.buffer.get_line_count()
+        self.format_lines(0, self.buffer.get_line_count() - 1)
+
+    def on_insert_text(self, _buffer, location, text, _length):
+        # Gtk treats \n, \r, \r\n and the paragraph separator as line breaks
+        new_lines = (
+            text.count("\n")
+            + text.count("\r")
+            - text.count("\r\n")
+            + text.count("\u2029")
+        )
+        first = location.get_line()
+        self.code_states[first + 1 : first + 1] = [None] * new_lines
+        self.mark_dirty(first, first + new_lines)
+
+    def on_delete_range(self, _buffer, start, end):
+        first = start.get_line()
+        del self.code_states[first + 1 : end.get_line() + 1]
+        self.mark_dirty(first, first)
+
+    def mark_dirty(self, first, last):
+        if self.dirty is None:
+            self.dirty = first, last
+        else:
+            # Another edit hasn't been formatted yet, line numbers may have moved
+            self.dirty = 0, self.buffer.get_line_count() - 1
+
+    # Every edit and loaded chunk of a page is formatted here
+    @timed("JournalPage.format")
+    def on_changed(self, buffer):
+        # The insert and delete handlers run before the change, this after it
+        if len(self.code_states) != buffer.get_line_count() + 1:
+            # Lost track of the lines, e.g. a \r was inserted before a \n
+            self.format()
+        elif self.dirty is not None:
+            first, last = self.dirty
+            self.dirty = None
+            self.format_lines(first, last)
+
+    def format_lines(self, first, last):
+        """Re-tag lines first to last, and any after them whose code state changed"""
+        code = self.code_states[first]
+        for i in range(first, self.buffer.get_line_count()):
+            start = self.buffer.get_iter_at_line(i)[1]
+            end = start.copy()
+            if not end.ends_line():
+                end.forward_to_line_end()
+            self.buffer.remove_all_tags(start, end)
+            text = self.buffer.get_text(start, end, True)
+            if text == "```":
+                code ^= True
+                self.buffer.apply_tag(self.tags["code"], start, end)
+            elif code:
+                self.buffer.apply_tag(self.tags["code"], start, end)
+            elif text.startswith("# "):
+                self.buffer.apply_tag(self.tags["title"], start, end)
+            elif text == "====================":
+                self.buffer.apply_tag(self.tags["rule"], start, end)
+            elif text.startswith("* "):
+                bullet_end = start.copy()
+                bullet_end.forward_char()
+                self.buffer.apply_tag(self.tags["bullet"], start, bullet_end)
+            if i >= last and self.code_states[i + 1] == code:
+                break
+            self.code_states[i + 1] = code
+
+
 @templated
 class JournalPage(Gtk.ScrolledWindow):
     __gtype_name__ = "JournalPage"
     text_area = Gtk.Template.Child("text_area")
+    AUTOSAVE_DELAY = 3  # Seconds without edits before saving
+    LOAD_CHUNK_SIZE = 32 * 1024  # Characters added to the buffer at a time
+    # Single thread so saves (from any page) are written in order
+    writer = ThreadPoolExecutor(max_workers=1)
+    autosave_source = None
+    load_source = None
+    loading = False
 
     def __init__(self, backend, date):
         super().__init__()
         self.backend = backend
         self.date = date
         self.buffer = self.text_area.get_buffer()
-        self.tags = {
-            "title": self.buffer.create_tag("title", foreground="pink", font="Sans 20"),
-            "bullet": self.buffer.create_tag("bullet", foreground="green"),
-            "code": self.buffer.create_tag("code", font="Monospace"),
-            "rule": self.buffer.create_tag("rule", foreground="green"),
-        }
-        self.buffer.connect("changed", lambda *_: self.format())
+        self.formatter = Formatter(self.buffer)
+        self.tags = self.formatter.tags
         for shortcut, action in (
             ("<Control>space", self.insert_line),
             ("<Control>H", self.insert_header),
@@ -174,39 +352,105 @@ class JournalPage(Gtk.ScrolledWindow):
                     Gtk.CallbackAction.new(action),
                 )
             )
-        self.buffer.set_text(self.backend.get_day(self.date))
+        self.buffer.connect("changed", self.on_changed)
+        self.load(self.backend.get_day(self.date))
+
+    def load(self, text):
+        """
+        Replace the buffer contents with text. Large days are shown a chunk at a
+        time, the rest is appended when idle so the page appears immediately.
+        """
+        self.stop_loading()
+        self.pending = text
+        self.pending_offset = 0
+        self.loading = True
+        self.buffer.set_text("")
+        self.loading = False
+        self.load_chunk()
+        if self.pending_offset < len(self.pending):
+            # Editing now would put text in the wrong place
+            self.text_area.set_editable(False)
+            self.load_source = GLib.idle_add(self.on_load_idle)
+
+    def load_chunk(self, size=LOAD_CHUNK_SIZE):
+        start = self.pending_offset
+        # Split at a line break so each line is formatted once
+        end = self.pending.find("\n", start + size) + 1 or len(self.pending)
+        self.pending_offset = end
+        # Loading is not an edit, so it can't be undone and isn't saved
+        self.loading = True
+        self.buffer.begin_irreversible_action()
+        self.buffer.insert(self.buffer.get_end_iter(), self.pending[start:end])
+        self.buffer.end_irreversible_action()
+        self.loading = False
+        # Modified means there are edits which haven't been sent to the backend
+        self.buffer.set_modified(False)
+
+    def on_load_idle(self):
+        self.load_chunk()
+        if self.pending_offset < len(self.pending):
+            return True
+        self.load_source = None
+        self.stop_loading()
+        return False
+
+    def stop_loading(self):
+        if self.load_source:
+            GLib.source_remove(self.load_source)
+            self.load_source = None
+        self.pending = ""
+        self.text_area.set_editable(True)
+
+    def reload(self):
+        """Load the day again after it changed outside the app, unless it was edited"""
+        if not self.buffer.get_modified():
+            self.load(self.backend.get_day(self.date))
+
+    def on_changed(self, *_):
+        if self.loading:
+            return
+        # Restart the timer so a burst of edits gives one save
+        if self.autosave_source:
+            GLib.source_remove(self.autosave_source)
+        self.autosave_source = GLib.timeout_add_seconds(
+            self.AUTOSAVE_DELAY, self.autosave
+        )
+
+    def autosave(self):
+        self.autosave_source = None
+        self.buffer.set_modified(False)
+        future = self.writer.submit(self.backend.save_day, self.date, self.get_text())
+        future.add_done_callback(self.on_autosave_done)
+        return False
+
+    def on_autosave_done(self, future):
+        if future.exception():
+            GLib.idle_add(self.show_error, f"Autosave failed: {future.exception()}")
+
+    def show_error(self, text):
+        from epiccakeking_journal.modals import ErrorDialog
+
+        ErrorDialog(self.get_root(), text)
+        return False
 
     def save(self):
-        return self.backend.save_day(self.date, self.get_text())
+        """Save now, waiting for any autosave in progress"""
+        if self.autosave_source:
+            GLib.source_remove(self.autosave_source)
+            self.autosave_source = None
+        self.buffer.set_modified(False)
+        return self.writer.submit(
+            self.backend.save_day, self.date, self.get_text()
+        ).result()
 
     def get_text(self):
-        return self.buffer.get_text(*self.buffer.get_bounds(), True)
+        text = self.buffer.get_text(*self.buffer.get_bounds(), True)
+        # The page can't be edited while loading, so the rest is still as loaded
+        return text + self.pending[self.pending_offset :]
 
     def focus(self):
         self.text_area.grab_focus()
 
-    def format(self):
-        self.buffer.remove_all_tags(*self.buffer.get_bounds())
-        code = False
-        for i in range(self.buffer.get_line_count()):
-            start = self.buffer.get_iter_at_line(i)[1]
-            end = start.copy()
-            end.forward_to_line_end()
-            text = self.buffer.get_text(start, end, True)
-            if text == "```":
-                code ^= True
-                self.buffer.apply_tag(self.tags["code"], start, end)
-            elif code:
-                self.buffer.apply_tag(self.tags["code"], start, end)
-            elif text.startswith("# "):
-                self.buffer.apply_tag(self.tags["title"], start, end)
-            elif text == "====================":
-                self.buffer.apply_tag(self.tags["rule"], start, end)
-            elif text.startswith("* "):
-                bullet_end = start.copy()
-                bullet_end.forward_char()
-                self.buffer.apply_tag(self.tags["bullet"], start, bullet_end)
-
     def insert_line(self, *_):
         self.buffer.insert_at_cursor("\n====================\n")
 
@@ -239,5 +483,4 @@ class JournalPage(Gtk.ScrolledWindow):
             offset = self.buffer.get_property("cursor-position")
             self.buffer.insert_at_cursor("\n```\n")
             self.buffer.place_cursor(self.buffer.get_iter_at_offset(offset))
-        self.format()
         self.buffer.end_user_action()
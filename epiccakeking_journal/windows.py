@@ -0,0 +1,307 @@
+"""
+Copyright 2022 epiccakeking
+
+This file is part of epiccakeking_journal.
+
+epiccakeking_journal is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+epiccakeking_journal is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+epiccakeking_journal. If not, see <https://www.gnu.org/licenses/>.
+"""
+import datetime
+from pathlib import Path
+
+from gi.repository import Gtk, Gio, GLib
+
+from epiccakeking_journal.backend import migrate, open_backend
+from epiccakeking_journal.instrumentation import recorder, timed
+from epiccakeking_journal.profiling import StartupProfile
+from epiccakeking_journal.utilities import read_resource, templated
+from epiccakeking_journal.widgets import SearchResults, WordCloud, JournalPage
+
+
+@templated
+class MainWindow(Gtk.ApplicationWindow):
+    __gtype_name__ = "MainWindow"
+    backward = Gtk.Template.Child("backward")
+    forward = Gtk.Template.Child("forward")
+    calendar_menu = Gtk.Template.Child("calendar_menu")
+    calendar = Gtk.Template.Child("calendar")
+    page = None
+    watcher = None
+
+    def __init__(self, app, settings, profile=None):
+        super().__init__(application=app)
+        self.profile = profile or StartupProfile()
+
+        self.connect("close-request", self.on_close_request)
+        self.backward.connect("clicked", self.on_backward)
+        self.forward.connect("clicked", self.on_forward)
+        self.calendar_menu.connect("show", self.on_calendar_activate)
+        self.setup_calendar()
+        self.setup_actions()
+        self.settings = settings
+        self.set_backend(self.open_backend(self.settings.get("storage")))
+
+        self.change_day(datetime.date.today())
+        self.page.focus()
+        self.add_css()
+        self.present()
+        GLib.idle_add(self.on_first_frame, priority=GLib.PRIORITY_LOW)
+
+    def add_css(self):
+        css = Gtk.CssProvider()
+        css.load_from_data(read_resource("css/main.css"))
+        Gtk.StyleContext().add_provider_for_display(
+            self.get_display(), css, Gtk.STYLE_PROVIDER_PRIORITY_USER
+        )
+
+    def on_first_frame(self):
+        self.profile.mark("first frame")
+        self.profile.finish()
+        return False
+
+    def setup_actions(self):
+        """initialize action handlers"""
+        # Modals are only imported when first opened
+        self.set_action("stats", lambda *_: self.open_modal("StatsModal"))
+        self.set_action("settings", lambda *_: self.open_modal("SettingsModal"))
+        self.set_action("about", lambda *_: self.open_modal("AboutModal"))
+        self.set_action("search", lambda *_: self.open_modal("SearchModal"))
+        self.set_action("insert_line", lambda *_: self.page.insert_line())
+        self.set_action("insert_header", lambda *_: self.page.insert_header())
+        self.set_action("insert_code", lambda *_: self.page.insert_code())
+        if recorder.enabled:
+            self.set_action("timings", lambda *_: self.open_modal("TimingsModal"))
+            self.get_application().set_accels_for_action(
+                "win.timings", ["<Control><Shift>d"]
+            )
+
+    def setup_calendar(self):
+        self.calendar.connect("day-selected", self.on_calendar_select)
+        # Update the calendar when the displayed month changes
+        for signal in ("next-month", "next-year", "prev-month", "prev-year"):
+            self.calendar.connect(signal, self.update_calendar)
+
+    def open_backend(self, storage):
+        return open_backend(
+            Path(GLib.get_user_data_dir())
+            / self.get_application().get_application_id()
+            / "journal",
+            storage,
+        )
+
+    def change_storage(self, storage):
+        """Move the journal to another storage engine and switch to it"""
+        if not self.page.save():
+            return False
+        backend = self.open_backend(storage)
+        migrate(self.backend, backend)
+        self.set_backend(backend)
+        return self.change_day(self.page.date)
+
+    def set_backend(self, backend):
+        if self.watcher:
+            self.watcher.cancel()
+        self.backend = backend
+        self.backend.add_listener(self.on_day_changed)
+        self.watcher = self.backend.watch()
+
+    def on_day_changed(self, date):
+        """Update views after a day changed outside the app"""
+        if self.page and date == self.page.date:
+            self.page.reload()
+        self.update_calendar()
+
+    def open_modal(self, name, *args):
+        from epiccakeking_journal import modals
+
+        return getattr(modals, name)(self, *args)
+
+    def set_action(self, name, handler):
+        """Connect an action"""
+        action = Gio.SimpleAction.new(name, None)
+        action.connect("activate", handler)
+        self.add_action(action)
+
+    def on_close_request(self, *_):
+        """Ensure journal is saved before closing"""
+        try:
+            return not self.page.save()
+        except Exception as e:
+            self.open_modal("ErrorDialog", str(e))
+            return True  # Cancel the close request
+
+    def change_day(self, date):
+        """Set which day to show"""
+        if self.page and not self.page.save():
+            return False
+        page = JournalPage(self.backend, date)
+        self.set_child(page)
+        self.page = page
+        date_format = self.settings.get("date_format") or "%Y-%m-%d"
+        self.set_title("Journal: " + date.strftime(date_format))
+        return True
+
+    def on_backward(self, *_):
+        self.change_day(self.page.date - datetime.timedelta(days=1))
+
+    def on_forward(self, *_):
+        self.change_day(self.page.date + datetime.timedelta(days=1))
+
+    def on_calendar_activate(self, *_):
+        """Sync calendar to current date"""
+        self.calendar.select_day(
+            GLib.DateTime(GLib.TimeZone.new_utc(), *self.page.date.timetuple()[:6])
+        )
+        self.update_calendar()
+
+    def on_calendar_select(self, *_):
+        self.change_day(datetime.date(*self.calendar.get_date().get_ymd()))
+        self.update_calendar()
+
+    @timed("MainWindow.update_calendar")
+    def update_calendar(self, *_):
+        """Reload edited day indicators"""
+        # Hacky workaround because Gtk marks are a terrible system
+        grid = self.calendar.get_last_child()
+        month_offset = -1
+        row = 1
+        date = self.calendar.get_date()
+        year, month, _day = date.get_ymd()
+        edited = self.backend.edited_days_by_month(
+            datetime.date(year - (month == 1), (month - 2) % 12 + 1, 1),
+            datetime.date(year + (month == 12), month % 12 + 1, 1),
+        )
+        # Iterate over the rows of the calendar
+        while grid.get_child_at(1, row):
+            for x in range(1, 8):
+                child = grid.get_child_at(x, row)
+                if int(child.has_css_class("other-month")) != month_offset % 2:
+                    month_offset += 1
+                day = int(child.get_label())
+                month_days = edited[
+                    year + (month + month_offset - 1) // 12,
+                    (month + month_offset - 1) % 12 + 1,
+                ]
+                if day in month_days:
+                    child.add_css_class("edited")
+                else:
+                    child.remove_css_class("edited")
+            row += 1
+
+
+@templated
+class AltGui(Gtk.ApplicationWindow):
+    __gtype_name__ = "AltGui"
+    backward = Gtk.Template.Child("backward")
+    forward = Gtk.Template.Child("forward")
+    calendar = Gtk.Template.Child("calendar")
+    pane = Gtk.Template.Child("pane")
+    box = Gtk.Template.Child("box")
+    search = Gtk.Template.Child("search")
+    stack = Gtk.Template.Child("stack")
+    search_scroller = Gtk.Template.Child("search_scroller")
+    page = None
+    watcher = None
+    results = None
+
+    def __init__(self, app, settings, profile=None):
+        Gtk.ApplicationWindow.__init__(self, application=app)
+        self.profile = profile or StartupProfile()
+
+        self.connect("close-request", self.on_close_request)
+        self.backward.connect("clicked", self.on_backward)
+        self.forward.connect("clicked", self.on_forward)
+        self.calendar.connect("day-selected", self.on_calendar_select)
+        self.search.connect("changed", self.on_search_input)
+        MainWindow.setup_actions(self)
+        MainWindow.setup_calendar(self)
+        self.settings = settings
+        self.set_backend(self.open_backend(self.settings.get("storage")))
+        # The word cloud is built once the window has been shown
+        self.cloud = None
+
+        self.change_day(datetime.date.today())
+        self.page.focus()
+        MainWindow.on_calendar_activate(self)
+        self.add_css()
+        self.present()
+        GLib.idle_add(self.on_first_frame, priority=GLib.PRIORITY_LOW)
+
+    def on_first_frame(self):
+        self.profile.mark("first frame")
+        with self.profile.phase("word cloud"):
+            self.cloud = WordCloud(press_callback=self.search.set_text)
+            self.update_cloud()
+            self.stack.add_child(self.cloud)
+            if not self.search.get_text():
+                self.stack.set_visible_child(self.cloud)
+        self.profile.finish()
+        return False
+
+    # Reuse functions from MainWindow
+    on_close_request = MainWindow.on_close_request
+    on_calendar_select = MainWindow.on_calendar_select
+    set_action = MainWindow.set_action
+    open_modal = MainWindow.open_modal
+    add_css = MainWindow.add_css
+    open_backend = MainWindow.open_backend
+    change_storage = MainWindow.change_storage
+    set_backend = MainWindow.set_backend
+    update_calendar = MainWindow.update_calendar
+
+    def on_backward(self, *_):
+        MainWindow.on_backward(self)
+        MainWindow.on_calendar_activate(self)
+
+    def on_forward(self, *_):
+        MainWindow.on_forward(self)
+        MainWindow.on_calendar_activate(self)
+
+    def on_day_changed(self, date):
+        MainWindow.on_day_changed(self, date)
+        self.update_cloud()
+
+    def change_day(self, date):
+        if self.page and not self.page.save():
+            return False
+        page = JournalPage(self.backend, date)
+        self.pane.set_end_child(page)
+        self.page = page
+        date_format = self.settings.get("date_format") or "%Y-%m-%d"
+        self.set_title(f"Journal: {date.strftime(date_format)}")
+        self.update_cloud()
+        return True
+
+    @timed("AltGui.update_cloud")
+    def update_cloud(self):
+        if self.cloud is None:
+            return
+        self.cloud.load(
+            self.backend.top_words(
+                WordCloud.MAX_WORDS,
+                self.settings.get("word_cloud_exclusions"),
+                self.settings.get("approximate_word_cloud"),
+            )
+        )
+
+    def on_search_input(self, *_):
+        if self.results:
+            self.results.cancel()
+            self.results = None
+        text = self.search.get_text()
+        if not text:
+            if self.cloud:
+                self.stack.set_visible_child(self.cloud)
+            return
+        self.results = SearchResults(self, self.backend, text)
+        self.search_scroller.set_child(self.results)
+        self.stack.set_visible_child(self.search_scroller)
@@ -0,0 +1,49 @@
+"""
+Copyright 2022 epiccakeking
+
+This file is part of epiccakeking_journal.
+
+epiccakeking_journal is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+epiccakeking_journal is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+epiccakeking_journal. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import shutil
+import subprocess
+from pathlib import Path
+
+from setuptools import setup
+from setuptools.command.build_py import build_py
+
+
+class BuildWithResources(build_py):
+    """Compile the UI and CSS into a resource bundle when glib-compile-resources exists"""
+
+    def run(self):
+        super().run()
+        compiler = shutil.which("glib-compile-resources")
+        if not compiler:
+            # The app falls back to the loose files
+            return
+        source = Path("epiccakeking_journal")
+        target = Path(self.build_lib) / "epiccakeking_journal" / "journal.gresource"
+        subprocess.run(
+            [
+                compiler,
+                f"--sourcedir={source}",
+                f"--target={target}",
+                str(source / "journal.gresource.xml"),
+            ],
+            check=True,
+        )
+
+
+setup(cmdclass={"build_py": BuildWithResources})
@@ -0,0 +1,106 @@
+"""
+Copyright 2022 epiccakeking
+
+This file is part of epiccakeking_journal.
+
+epiccakeking_journal is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+epiccakeking_journal is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+epiccakeking_journal. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import datetime
+import os
+from pathlib import Path
+
+import pytest
+
+from epiccakeking_journal.backend import Backend
+
+DAYS = {
+    datetime.date(2020, 1, 6): "# Monday\nfirst day\n",
+    datetime.date(2020, 1, 11): "second day\r\nwith a CRLF\r\n",
+    datetime.date(2020, 3, 2): "third day",
+}
+
+
+def open_fds():
+    return len(os.listdir("/proc/self/fd"))
+
+
+@pytest.fixture
+def backend(tmp_path):
+    backend = Backend(tmp_path / "journal")
+    backend.save_days(DAYS.items())
+    return backend
+
+
+def test_pack_round_trip(backend):
+    backend.pack_year(2020)
+    assert not (backend.path / "2020").exists()
+    assert backend.packed_years() == {2020}
+    for reopened in (backend, Backend(backend.path)):
+        assert list(reopened.get_edited_days()) == sorted(DAYS)
+        for date, content in DAYS.items():
+            assert reopened.get_day(date) == content.replace("\r\n", "\n")
+
+    # Editing a packed day moves it back to the year's directory
+    edited = datetime.date(2020, 1, 11)
+    backend.save_day(edited, "edited")
+    assert backend.get_date_path(edited).exists()
+    assert edited not in backend.get_pack(2020)
+    reopened = Backend(backend.path)
+    assert reopened.get_day(edited) == "edited"
+    assert reopened.get_day(datetime.date(2020, 3, 2)) == "third day"
+
+    # Repacking merges it into the pack again
+    backend.pack_year(2020)
+    assert not (backend.path / "2020").exists()
+    assert edited in backend.get_pack(2020)
+    reopened = Backend(backend.path)
+    assert reopened.get_day(edited) == "edited"
+    assert reopened.month_edited_days(datetime.date(2020, 1, 1)) == [6, 11]
+
+    # Emptying every packed day removes the pack
+    backend.save_days((date, "") for date in DAYS)
+    assert backend.packed_years() == set()
+    assert list(Backend(backend.path).get_edited_days()) == []
+
+
+def test_replaced_pack_stays_readable(backend):
+    backend.pack_year(2020)
+    old_pack = backend.get_pack(2020)
+    # Like a search thread reading while an autosave rewrites the pack
+    backend.save_day(datetime.date(2020, 1, 6), "edited")
+    assert backend.get_pack(2020) is not old_pack
+    assert old_pack.read(datetime.date(2020, 3, 2)) == "third day"
+
+
+@pytest.mark.skipif(not Path("/proc/self/fd").exists(), reason="needs /proc")
+def test_repacking_doesnt_leak_files(backend):
+    backend.pack_year(2020)
+    backend.get_day(datetime.date(2020, 3, 2))
+    before = open_fds()
+    for i in range(5):
+        backend.save_day(datetime.date(2020, 1, 6), f"edit {i}")
+        backend.pack_year(2020)
+        assert backend.get_day(datetime.date(2020, 3, 2)) == "third day"
+    assert open_fds() == before
+
+
+def test_limit_stops_listing_months(backend, monkeypatch):
+    listed = []
+    scandir = os.scandir
+    monkeypatch.setattr(
+        os, "scandir", lambda path: listed.append(Path(path)) or scandir(path)
+    )
+    assert list(backend.get_edited_days(limit=1)) == [datetime.date(2020, 1, 6)]
+    assert backend.path / "2020" / "01" in listed
+    assert backend.path / "2020" / "03" not in listed
@@ -0,0 +1,96 @@
+"""
+Copyright 2022 epiccakeking
+
+This file is part of epiccakeking_journal.
+
+epiccakeking_journal is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+epiccakeking_journal is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+epiccakeking_journal. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import datetime
+import json
+
+import pytest
+
+from epiccakeking_journal.backend import Backend
+from epiccakeking_journal.cli import run_command
+
+DAYS = {
+    datetime.date(2020, 1, 6): "# Monday\nfirst day\n",
+    datetime.date(2020, 1, 11): "second day\nno newline at the end",
+    datetime.date(2021, 3, 2): "third day\n\n",
+}
+
+
+@pytest.fixture(autouse=True)
+def settings(tmp_path, monkeypatch):
+    # Keep the user's settings out of the tests
+    monkeypatch.setenv("XDG_CONFIG_HOME", str(tmp_path / "config"))
+    monkeypatch.delenv("JOURNAL_INSTRUMENTATION", raising=False)
+
+
+@pytest.fixture
+def source(tmp_path):
+    backend = Backend(tmp_path / "source")
+    backend.save_days(DAYS.items())
+    return backend
+
+
+def imported(capsys):
+    """The (days, unchanged) counts printed by the last import"""
+    message = capsys.readouterr().err.split()
+    return int(message[1]), int(message[3])
+
+
+def read_journal(path):
+    backend = Backend(path)
+    return {day: backend.get_day(day) for day in backend.get_edited_days()}
+
+
+@pytest.mark.parametrize("format", ["jsonl", "markdown", "tar"])
+def test_round_trip(source, tmp_path, capsys, format):
+    export = tmp_path / f"export.{format}"
+    target = tmp_path / "target"
+    common = ["--journal", str(source.path), "--format", format]
+    assert run_command(["export", *common, "--output", str(export)]) == 0
+    common = ["--journal", str(target), "--format", format, "--input", str(export)]
+    assert run_command(["import", *common]) == 0
+    assert imported(capsys) == (3, 0)
+    assert read_journal(target) == DAYS
+
+    # Importing again changes nothing
+    assert run_command(["import", *common]) == 0
+    assert imported(capsys) == (3, 3)
+    assert read_journal(target) == DAYS
+
+
+def test_import_deletes_empty_days(tmp_path, capsys):
+    target = Backend(tmp_path / "target")
+    target.save_days(DAYS.items())
+    # A deletion before a new day in the same month of a packed year
+    target.pack_year(2020)
+    changes = tmp_path / "changes.jsonl"
+    changes.write_text(
+        json.dumps(dict(date="2020-01-06", content=""))
+        + "\n"
+        + json.dumps(dict(date="2020-01-20", content="new"))
+        + "\n"
+    )
+    assert (
+        run_command(["import", "--journal", str(target.path), "--input", str(changes)])
+        == 0
+    )
+    assert imported(capsys) == (2, 0)
+    expected = dict(DAYS)
+    del expected[datetime.date(2020, 1, 6)]
+    expected[datetime.date(2020, 1, 20)] = "new"
+    assert read_journal(target.path) == expected
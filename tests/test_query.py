@@ -0,0 +1,163 @@
+"""
+Copyright 2022 epiccakeking
+
+This file is part of epiccakeking_journal.
+
+epiccakeking_journal is free software: you can redistribute it and/or modify it under
+the terms of the GNU General Public License as published by the
+Free Software Foundation, either version 3 of the License, or (at your option) any later
+version.
+
+epiccakeking_journal is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or
+FITNESS FOR A PARTICULAR PURPOSE. See the GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License along with
+epiccakeking_journal. If not, see <https://www.gnu.org/licenses/>.
+"""
+
+import datetime
+
+import pytest
+
+from epiccakeking_journal.query import (
+    And,
+    DateRange,
+    Not,
+    Or,
+    Query,
+    QueryError,
+    Regex,
+    Term,
+)
+
+
+class MemoryBackend:
+    """The parts of a backend used by queries, with days kept in a dict"""
+
+    def __init__(self, days):
+        self.days = days
+        self.searched = []
+
+    def get_edited_days(self, start=None, end=None):
+        for day in sorted(self.days):
+            if (start is None or day >= start) and (end is None or day <= end):
+                yield day
+
+    def get_day(self, date):
+        return self.days.get(date, "")
+
+    def term_days(self, term):
+        return {
+            day.isoformat()
+            for day, content in self.days.items()
+            if term in content.lower()
+        }
+
+    def search(self, term, cancelled=None):
+        self.searched.append(term)
+        for day in self.get_edited_days():
+            for i, line in enumerate(self.days[day].splitlines(True)):
+                if term in line.lower():
+                    yield day, i, line
+
+
+def test_tokenize():
+    assert Query.tokenize('a "b c" /d e/ (f) date:2021 ') == [
+        ("word", "a"),
+        ("phrase", "b c"),
+        ("regex", "d e"),
+        ("paren", "("),
+        ("word", "f"),
+        ("paren", ")"),
+        ("word", "date:2021"),
+    ]
+
+
+def test_unterminated_quote_runs_to_the_end():
+    assert Query.tokenize('a "b c') == [("word", "a"), ("phrase", "b c")]
+    root = Query('"b c').root
+    assert isinstance(root, Term) and root.text == "b c"
+
+
+def test_precedence():
+    # NOT binds tighter than AND, which binds tighter than OR
+    root = Query("a NOT b OR c AND d").root
+    assert isinstance(root, Or)
+    first, second = root.children
+    assert isinstance(first, And) and isinstance(first.children[1], Not)
+    assert isinstance(second, And)
+    assert [x.text for x in second.children] == ["c", "d"]
+
+
+def test_parentheses():
+    root = Query("a (b OR c)").root
+    assert isinstance(root, And) and isinstance(root.children[1], Or)
+
+
+@pytest.mark.parametrize("text", ["(a", "a)", "a OR", "NOT", "/(/", "date:2021-13"])
+def test_invalid(text):
+    with pytest.raises(QueryError):
+        Query(text)
+
+
+@pytest.mark.parametrize(
+    "text, start, end",
+    [
+        ("date:2021", datetime.date(2021, 1, 1), datetime.date(2021, 12, 31)),
+        ("date:2024-02", datetime.date(2024, 2, 1), datetime.date(2024, 2, 29)),
+        (
+            "date:2021-03..2021-06",
+            datetime.date(2021, 3, 1),
+            datetime.date(2021, 6, 30),
+        ),
+        ("date:..2021-06-15", None, datetime.date(2021, 6, 15)),
+        ("date:2021-03-04..", datetime.date(2021, 3, 4), None),
+    ],
+)
+def test_date_ranges(text, start, end):
+    root = Query(text).root
+    assert isinstance(root, DateRange)
+    assert (root.start, root.end) == (start, end)
+
+
+def test_date_range_of_and_is_the_intersection():
+    query = Query("date:2021 date:2021-06..2022 a")
+    assert (query.start, query.end) == (
+        datetime.date(2021, 6, 1),
+        datetime.date(2021, 12, 31),
+    )
+
+
+def test_regex_ignores_case():
+    root = Query(r"/b\d+/").root
+    assert isinstance(root, Regex)
+    assert root.match(None, "aB12", "ab12")
+    assert not root.match(None, "ab", "ab")
+
+
+DAYS = {
+    datetime.date(2021, 1, 1): "Apples and pears\nonly pears\n",
+    datetime.date(2021, 6, 1): "apples\nplums\n",
+    datetime.date(2022, 1, 1): "plums and apples\n",
+}
+
+
+def test_single_term_uses_backend_search():
+    backend = MemoryBackend(DAYS)
+    results = list(Query("Apples").search(backend))
+    assert backend.searched == ["apples"]
+    assert [(day.year, i) for day, i, _line in results] == [
+        (2021, 0),
+        (2021, 0),
+        (2022, 0),
+    ]
+
+
+def test_search():
+    backend = MemoryBackend(DAYS)
+    results = list(Query("apples (pears OR plums) date:..2021").search(backend))
+    assert backend.searched == []
+    assert results == [(datetime.date(2021, 1, 1), 0, "Apples and pears\n")]
+    results = list(Query("pears NOT apples").search(backend))
+    assert results == [(datetime.date(2021, 1, 1), 1, "only pears\n")]